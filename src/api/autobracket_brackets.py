@@ -0,0 +1,539 @@
+"""Bracket-level helpers for autobracket.
+
+Brackets only need each matchup's SimulationDist summary, so everything here works
+off a MatchupMatrix: every pair of teams in a season laid out in dense N x N arrays
+keyed by integer team codes, cached until new SimulationDist rows show up.
+
+Bracket structure comes from a BracketTree, the matchup table turned into integer
+arrays, so whole rounds of many brackets advance in one vectorized step. Saved
+brackets are checked the same way, as one int16 matrix of picks.
+
+SimulationDist rows are stored once per unordered pair of teams, with the lower
+team key as home_key and every stat from that team's side. Save them with
+save_distributions and use oriented_distribution to read one back from the
+caller's side. SimulationRun lookup columns follow the same order, with
+home_margin from the stored home team's side; see canonical_keys.
+
+"""
+# import third party packages
+from fastapi import HTTPException
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# import custom local stuff
+from src.db.models import BracketFlavor, SimulatedBracketORM, SimulationDistORM
+
+
+# SimulationDist columns for each flavor: home win chance, then the home margin
+# breakpoints at the top and bottom of the flavor's range
+FLAVOR_COLUMNS = {
+    BracketFlavor.NONE: (
+        "home_win_chance_median",
+        "median_margin_top",
+        "median_margin_bottom",
+    ),
+    BracketFlavor.MILD: (
+        "home_win_chance_mild",
+        "mild_margin_top",
+        "mild_margin_bottom",
+    ),
+    BracketFlavor.MEDIUM: (
+        "home_win_chance_medium",
+        "medium_margin_top",
+        "medium_margin_bottom",
+    ),
+    BracketFlavor.MAX: (
+        "home_win_chance_max",
+        "max_margin_top",
+        "max_margin_bottom",
+    ),
+}
+
+
+# SimulationDist columns that identify a pair, unique together
+MATCHUP_COLUMNS = ["season", "home_key", "away_key"]
+
+# insert constructs that can upsert, for each DB dialect the app runs on
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def flip_distribution(distribution):
+    """The same SimulationDist document, from the away team's side."""
+    flipped = dict(distribution)
+    flipped["away_key"] = distribution["home_key"]
+    flipped["home_key"] = distribution["away_key"]
+    for chance_column, top_column, bottom_column in FLAVOR_COLUMNS.values():
+        # flip the chance, and flip high and low margins AND the sign
+        flipped[chance_column] = 1 - distribution[chance_column]
+        flipped[top_column] = -distribution[bottom_column]
+        flipped[bottom_column] = -distribution[top_column]
+    flipped["median_margin"] = -distribution["median_margin"]
+    return flipped
+
+
+def canonical_distribution(distribution):
+    """A SimulationDist document the way it's stored, lower team key as home."""
+    if distribution["home_key"] > distribution["away_key"]:
+        return flip_distribution(distribution)
+    return dict(distribution)
+
+
+def save_distributions(session, distributions):
+    """Upsert SimulationDist documents in canonical order, one row per pair of teams.
+
+    A pair that was already simulated has its row replaced. The row also takes a
+    new id, so MatchupMatrixCache picks up the change.
+
+    """
+    rows = {}
+    for distribution in distributions:
+        row = canonical_distribution(distribution)
+        rows[tuple(row[column] for column in MATCHUP_COLUMNS)] = row
+    if not rows:
+        return
+
+    sql = UPSERTS[session.get_bind().dialect.name](SimulationDistORM)
+    sql = sql.on_conflict_do_update(
+        index_elements=MATCHUP_COLUMNS,
+        set_={
+            column.name: sql.excluded[column.name]
+            for column in SimulationDistORM.__table__.columns
+            if column.name not in MATCHUP_COLUMNS
+        },
+    )
+    session.execute(sql, list(rows.values()))
+
+
+def oriented_distribution(distribution, away_key, home_key):
+    """A stored SimulationDist document, from home_key's side against away_key."""
+    if (distribution["away_key"], distribution["home_key"]) == (home_key, away_key):
+        return flip_distribution(distribution)
+    return dict(distribution)
+
+
+def canonical_keys(away_key, home_key):
+    """A pair's stored (away_key, home_key), plus the sign that turns a stored
+    home margin into home_key's margin."""
+    if home_key > away_key:
+        return home_key, away_key, -1
+    return away_key, home_key, 1
+
+
+def matchup_filter(away_key, home_key):
+    """Where clause for a pair's stored SimulationDist rows, in either order."""
+    return (SimulationDistORM.home_key == min(away_key, home_key)) & (
+        SimulationDistORM.away_key == max(away_key, home_key)
+    )
+
+
+class MatchupMatrix:
+    """Win chances and margin breakpoints for every simulated pair of teams.
+
+    For each flavor, win_chance[flavor][i, j] is the chance team i beats team j
+    with i as the home team, and margin_top/margin_bottom hold the home margin
+    range from team i's side. Each SimulationDist row fills in both orientations,
+    so a game is a single array lookup no matter which team is home. Pairs that
+    were never simulated are NaN.
+
+    """
+
+    def __init__(self, distributions):
+        team_keys = sorted(
+            {row["away_key"] for row in distributions}
+            | {row["home_key"] for row in distributions}
+        )
+        self.team_codes = {key: code for code, key in enumerate(team_keys)}
+        away_codes = self.codes([row["away_key"] for row in distributions])
+        home_codes = self.codes([row["home_key"] for row in distributions])
+
+        self.win_chance = {}
+        self.margin_top = {}
+        self.margin_bottom = {}
+        for flavor, columns in FLAVOR_COLUMNS.items():
+            chance_column, top_column, bottom_column = columns
+            chances = np.array([row[chance_column] for row in distributions], float)
+            tops = np.array([row[top_column] for row in distributions], float)
+            bottoms = np.array([row[bottom_column] for row in distributions], float)
+
+            win_chance = np.full((len(team_keys), len(team_keys)), np.nan)
+            margin_top = np.full_like(win_chance, np.nan)
+            margin_bottom = np.full_like(win_chance, np.nan)
+            win_chance[home_codes, away_codes] = chances
+            margin_top[home_codes, away_codes] = tops
+            margin_bottom[home_codes, away_codes] = bottoms
+            # flip the chance, and flip high and low margins AND the sign
+            win_chance[away_codes, home_codes] = 1 - chances
+            margin_top[away_codes, home_codes] = -bottoms
+            margin_bottom[away_codes, home_codes] = -tops
+
+            self.win_chance[flavor] = win_chance
+            self.margin_top[flavor] = margin_top
+            self.margin_bottom[flavor] = margin_bottom
+
+    def codes(self, team_keys):
+        """Integer codes for an array of team keys."""
+        try:
+            return np.array([self.team_codes[key] for key in team_keys], dtype=np.intp)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="No data found!")
+
+    def lookup(self, flavor, away_keys, home_keys):
+        """(home win chance, margin top, margin bottom) for arrays of matchups."""
+        away_codes = self.codes(away_keys)
+        home_codes = self.codes(home_keys)
+        win_chance = self.win_chance[flavor][home_codes, away_codes]
+        if np.isnan(win_chance).any():
+            raise HTTPException(status_code=404, detail="No data found!")
+
+        return (
+            win_chance,
+            self.margin_top[flavor][home_codes, away_codes].astype(int),
+            self.margin_bottom[flavor][home_codes, away_codes].astype(int),
+        )
+
+
+class MatchupMatrixCache:
+    """One MatchupMatrix per season, rebuilt only when its SimulationDist rows change.
+
+    Checking for new rows is a single count/max(id) query, so brackets don't pay
+    to reload the distributions unless a simulation has saved new ones.
+
+    """
+
+    def __init__(self):
+        self.matrices = {}
+
+    def get(self, engine, season):
+        season_filter = SimulationDistORM.season == season.value
+        with Session(engine) as session:
+            version = tuple(
+                session.execute(
+                    select(
+                        func.count(SimulationDistORM.id), func.max(SimulationDistORM.id)
+                    ).where(season_filter)
+                ).one()
+            )
+            if not version[0]:
+                raise HTTPException(status_code=404, detail="No data found!")
+
+            cached_version, matrix = self.matrices.get(season, (None, None))
+            if cached_version != version:
+                sql = (
+                    select(SimulationDistORM.__table__)
+                    .where(season_filter)
+                    .order_by(SimulationDistORM.id)
+                )
+                distributions = session.execute(sql).mappings().all()
+                matrix = MatchupMatrix(distributions)
+                self.matrices[season] = (version, matrix)
+
+        return matrix
+
+
+matchup_matrices = MatchupMatrixCache()
+
+
+async def get_matchup_matrices():
+    return matchup_matrices
+
+
+class BracketTree:
+    """A tournament bracket as integer arrays, one entry per game in game_id order.
+
+    Teams are numbered by their position in team_keys. slots[g] holds the away and
+    home team of game g, with -1 for a TBD slot, and the winner of game g moves on
+    to slot next_side[g] of game next_game[g] (-1 for the title game), so
+    feeders[g] holds the games feeding each slot (-1 for a placed team). Games
+    with the same level only depend on earlier levels, so each level is resolved
+    in one step. round[g] counts from 0 for the earliest games up to the title
+    game.
+
+    """
+
+    def __init__(self, matchup_table_df):
+        games = matchup_table_df.sort_index()
+        self.game_ids = games.index.to_numpy()
+        game_positions = {game_id: g for g, game_id in enumerate(self.game_ids)}
+
+        # every team already placed in the bracket, with its seed and school
+        teams = pd.concat(
+            [
+                games[[f"{side}_key", f"{side}_seed", f"{side}_school"]].set_axis(
+                    ["key", "seed", "school"], axis=1
+                )
+                for side in ("away", "home")
+            ]
+        )
+        teams = teams.loc[teams.key != "TBD"].drop_duplicates("key")
+        self.team_keys = teams.key.to_numpy(dtype=object)
+        self.team_seeds = teams.seed.to_numpy()
+        self.team_schools = teams.school.to_numpy(dtype=object)
+        team_index = {key: team for team, key in enumerate(self.team_keys)}
+
+        self.slots = np.array(
+            [
+                [team_index.get(key, -1) for key in games[f"{side}_key"]]
+                for side in ("away", "home")
+            ],
+            dtype=np.intp,
+        ).T
+
+        # a winner fills the away slot of the next game if it's open, otherwise
+        # the home slot, same as advancing games one at a time in game_id order
+        self.next_game = np.full(len(games), -1, dtype=np.intp)
+        self.next_side = np.zeros(len(games), dtype=np.intp)
+        self.feeders = np.full((len(games), 2), -1, dtype=np.intp)
+        open_slots = self.slots == -1
+        self.level = np.zeros(len(games), dtype=np.intp)
+        for g, advance_to in enumerate(games.advance_to):
+            if advance_to not in game_positions:
+                continue
+            next_game = game_positions[advance_to]
+            next_side = 0 if open_slots[next_game, 0] else 1
+            open_slots[next_game, next_side] = False
+            self.next_game[g] = next_game
+            self.next_side[g] = next_side
+            self.level[next_game] = max(self.level[next_game], self.level[g] + 1)
+            self.feeders[next_game, next_side] = g
+
+        # rounds count up from the earliest games to the title game, by how many
+        # wins each game is away from the title
+        wins_from_title = np.zeros(len(games), dtype=np.intp)
+        for g in reversed(range(len(games))):
+            if self.next_game[g] >= 0:
+                wins_from_title[g] = wins_from_title[self.next_game[g]] + 1
+        self.round = wins_from_title.max() - wins_from_title
+
+        self.levels = [
+            np.flatnonzero(self.level == level) for level in range(self.level.max() + 1)
+        ]
+
+    def simulate(self, matrix, flavor, rerolls):
+        """Teams and winners of every game, for a batch of brackets.
+
+        rerolls is a (brackets x games) array of uniform draws, one per game like
+        the single bracket's sim_reroll column. Returns (slots, home_wins): the
+        away and home team of every game in every bracket, shaped (brackets x
+        games x 2), and whether the home team won each game.
+
+        """
+        # the matrix, cut down to this bracket's teams
+        team_codes = matrix.codes(self.team_keys)
+        win_chance = matrix.win_chance[flavor][np.ix_(team_codes, team_codes)]
+
+        brackets = len(rerolls)
+        slots = np.repeat(self.slots[None], brackets, axis=0)
+        home_wins = np.zeros(rerolls.shape, dtype=bool)
+        for games in self.levels:
+            away = slots[:, games, 0]
+            home = slots[:, games, 1]
+            home_win_chance = win_chance[home, away]
+            if np.isnan(home_win_chance).any():
+                raise HTTPException(status_code=404, detail="No data found!")
+
+            home_wins[:, games] = rerolls[:, games] < home_win_chance
+            winners = np.where(home_wins[:, games], home, away)
+
+            # advance the winners, unless it's the title game. then it's over!
+            advancing = self.next_game[games] >= 0
+            slots[
+                :, self.next_game[games[advancing]], self.next_side[games[advancing]]
+            ] = winners[:, advancing]
+
+        return slots, home_wins
+
+    def advancement(self, matrix, flavor):
+        """Exact chance of each team winning each game, shaped (games x teams).
+
+        Works through the levels like simulate, but carries a probability for
+        every team in every slot instead of one sampled team. A game's winner
+        chances are what its next game's slot starts with.
+
+        """
+        team_codes = matrix.codes(self.team_keys)
+        win_chance = matrix.win_chance[flavor][np.ix_(team_codes, team_codes)]
+        missing = np.isnan(win_chance)
+        win_chance = np.where(missing, 0, win_chance)
+
+        # chance of each team being in each slot, starting with the teams already
+        # placed in the bracket
+        teams = np.arange(len(self.team_keys))
+        slot_chances = (self.slots[..., None] == teams).astype(float)
+        game_win_chances = np.zeros((len(self.game_ids), len(self.team_keys)))
+        for games in self.levels:
+            away = slot_chances[games, 0]
+            home = slot_chances[games, 1]
+            # a pair that can meet but was never simulated can't be made up
+            if ((away @ missing.T) * home).any():
+                raise HTTPException(status_code=404, detail="No data found!")
+
+            # win_chance[i, j] is home team i's chance against away team j
+            game_win_chances[games] = away * (home @ (1 - win_chance)) + home * (
+                away @ win_chance.T
+            )
+
+            advancing = self.next_game[games] >= 0
+            slot_chances[
+                self.next_game[games[advancing]], self.next_side[games[advancing]]
+            ] = game_win_chances[games[advancing]]
+
+        return game_win_chances
+
+    def optimal_bracket(self, game_win_chances, round_points):
+        """The picks with the highest expected score, and that score.
+
+        round_points[r] is what a correct pick in round r is worth, so a pick adds
+        its points times its chance of being right. Working up the levels,
+        best[g, t] is the most a bracket can expect from game g and every game
+        feeding it if it has team t winning g. A team can only be picked to win a
+        game if it's picked to win the game it came from, so t's side of the
+        bracket has to go through t and the other side is free to pick its best.
+
+        """
+        teams = np.arange(len(self.team_keys))
+        best = np.full(game_win_chances.shape, -np.inf)
+        for games in self.levels:
+            # best total for each slot's subtree with t coming out of it, and the
+            # best total with anyone coming out of it
+            slot_best = np.where(
+                self.feeders[games, :, None] >= 0,
+                best[self.feeders[games]],
+                np.where(self.slots[games, :, None] == teams, 0, -np.inf),
+            )
+            slot_max = slot_best.max(axis=2, keepdims=True)
+            points = np.asarray(round_points)[self.round[games]]
+            best[games] = np.where(
+                game_win_chances[games] > 0,
+                points[:, None] * game_win_chances[games]
+                + np.maximum(
+                    slot_best[:, 0] + slot_max[:, 1], slot_best[:, 1] + slot_max[:, 0]
+                ),
+                -np.inf,
+            )
+
+        # walk back down from the title game, keeping each pick's path
+        picks = np.full(len(self.game_ids), -1, dtype=np.intp)
+        title_game = np.flatnonzero(self.next_game < 0)[0]
+        picks[title_game] = best[title_game].argmax()
+        for g in reversed(range(len(self.game_ids))):
+            for feeder in self.feeders[g]:
+                if feeder < 0:
+                    continue
+                if np.isfinite(best[feeder, picks[g]]):
+                    picks[feeder] = picks[g]
+                else:
+                    picks[feeder] = best[feeder].argmax()
+
+        return picks, best[title_game].max()
+
+    def team_codes(self, team_keys):
+        """int16 team numbers for an array of keys, -1 for anything not in the bracket."""
+        team_index = {key: team for team, key in enumerate(self.team_keys)}
+        return np.array([team_index.get(key, -1) for key in team_keys], dtype=np.int16)
+
+    def winners(self, slots, home_wins):
+        """Team keys of every game's winner, shaped like home_wins.
+
+        Works on a batch of brackets or on one bracket's slots and home_wins.
+
+        """
+        winners = np.take_along_axis(slots, home_wins[..., None].astype(np.intp), -1)
+        return self.team_keys[winners[..., 0]]
+
+
+# labels the performance checkers report each flavor under
+FLAVOR_LABELS = {
+    BracketFlavor.NONE: "Vanilla",
+    BracketFlavor.MILD: "Mild",
+    BracketFlavor.MEDIUM: "Medium",
+    BracketFlavor.MAX: "MAX SPICE",
+}
+FLAVOR_CODES = {flavor: code for code, flavor in enumerate(BracketFlavor)}
+
+
+class SimulatedBrackets:
+    """Saved SimulatedBracket rows as columns.
+
+    picks[b, g] is bracket b's winner of game g as an int16 team number from a
+    BracketTree, and flavors[b] is its flavor's code in FLAVOR_CODES, so checking
+    every bracket against the real results is one comparison.
+
+    """
+
+    def __init__(self, ids, flavors, picks):
+        self.ids = ids
+        self.flavors = flavors
+        self.picks = picks
+
+    @classmethod
+    def from_rows(cls, tree, rows):
+        game_keys = [f"{game_id:02}" for game_id in tree.game_ids]
+        return cls(
+            np.array([row.id for row in rows], dtype=np.int64),
+            np.array([FLAVOR_CODES[row.flavor] for row in rows], dtype=np.int8),
+            tree.team_codes(
+                [row.bracket.get(key) for row in rows for key in game_keys]
+            ).reshape(len(rows), len(game_keys)),
+        )
+
+    def append(self, other):
+        return SimulatedBrackets(
+            np.concatenate([self.ids, other.ids]),
+            np.concatenate([self.flavors, other.flavors]),
+            np.concatenate([self.picks, other.picks]),
+        )
+
+    def correct(self, results):
+        """Which picks match the results, shaped (brackets x games)."""
+        return self.picks == results
+
+    def flavor_mask(self, flavor):
+        return self.flavors == FLAVOR_CODES[flavor]
+
+
+class SimulatedBracketCache:
+    """Every saved bracket as SimulatedBrackets, topped up as new ones are saved.
+
+    Only rows past the last cached id are read, so millions of brackets are only
+    decoded once. If rows were deleted the whole table is reloaded.
+
+    """
+
+    def __init__(self):
+        self.brackets = {}
+
+    def get(self, engine, tree):
+        columns = (
+            SimulatedBracketORM.id,
+            SimulatedBracketORM.flavor,
+            SimulatedBracketORM.bracket,
+        )
+        with Session(engine) as session:
+            count = session.execute(select(func.count(SimulatedBracketORM.id))).scalar()
+            if not count:
+                raise HTTPException(status_code=404, detail="No data found!")
+
+            brackets = self.brackets.get(tree, SimulatedBrackets.from_rows(tree, []))
+            last_id = int(brackets.ids.max(initial=0))
+            sql = select(*columns).where(SimulatedBracketORM.id > last_id)
+            new_rows = session.execute(sql.order_by(SimulatedBracketORM.id)).all()
+            brackets = brackets.append(SimulatedBrackets.from_rows(tree, new_rows))
+
+            # some brackets were deleted, so start over
+            if len(brackets.ids) != count:
+                sql = select(*columns).order_by(SimulatedBracketORM.id)
+                brackets = SimulatedBrackets.from_rows(tree, session.execute(sql).all())
+
+            self.brackets[tree] = brackets
+
+        return brackets
+
+
+simulated_brackets = SimulatedBracketCache()
+
+
+async def get_simulated_brackets():
+    return simulated_brackets
@@ -0,0 +1,1864 @@
+"""NumPy engine for the autobracket game simulation.
+
+All of the simulation state (clocks, possession flags, who is on the floor, and
+the box score counters) lives in dense arrays shaped (simulations x players).
+Games are simulated in fixed-size chunks and folded into a MarginAccumulator,
+so memory stays flat no matter how many games are requested. The pandas box
+score is only built once at the end, for the handful of games that actually get
+persisted.
+
+"""
+# import native Python packages
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import os
+import orjson
+import secrets
+import threading
+
+# import third party packages
+from fastapi import HTTPException
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+# import custom local stuff
+from src.api.autobracket_brackets import (
+    canonical_distribution,
+    canonical_keys,
+    save_distributions,
+)
+from src.db.models import (
+    CBBTeamORM,
+    PlayerSeasonORM,
+    VarianceReduction,
+)
+
+
+# integer box score counters, in the order they're reported in the box score.
+# sim_seconds is tracked separately since it's the only float counter.
+BOX_SCORE_COLUMNS = [
+    "sim_two_pointers_made",
+    "sim_two_pointers_attempted",
+    "sim_three_pointers_made",
+    "sim_three_pointers_attempted",
+    "sim_free_throws_made",
+    "sim_free_throws_attempted",
+    "sim_offensive_rebounds",
+    "sim_defensive_rebounds",
+    "sim_assists",
+    "sim_steals",
+    "sim_blocks",
+    "sim_turnovers",
+    "sim_fouls",
+]
+(
+    TWO_MADE,
+    TWO_ATTEMPTED,
+    THREE_MADE,
+    THREE_ATTEMPTED,
+    FT_MADE,
+    FT_ATTEMPTED,
+    OFF_REBOUNDS,
+    DEF_REBOUNDS,
+    ASSISTS,
+    STEALS,
+    BLOCKS,
+    TURNOVERS,
+    FOULS,
+) = range(len(BOX_SCORE_COLUMNS))
+
+# columns of the per-player rate tables. the defense's rates are looked up for
+# the five defenders and the offense's for the five on offense.
+DEFENSE_RATE_COLUMNS = ["Steals", "PersonalFouls", "BlockedShots"]
+STEAL_RATE, FOUL_RATE, BLOCK_RATE = range(len(DEFENSE_RATE_COLUMNS))
+OFFENSE_RATE_COLUMNS = ["Turnovers", "Assists"]
+TURNOVER_RATE, ASSIST_RATE = range(len(OFFENSE_RATE_COLUMNS))
+
+# quantiles of the home margin that get persisted and summarized
+KEY_QUANTILES = [0.00, 0.10, 0.25, 0.40, 0.50, 0.60, 0.75, 0.90, 1.00]
+EXTRA_QUANTILES = KEY_QUANTILES + [0.05, 0.175, 0.325, 0.675, 0.825, 0.95]
+
+# below this many games per shard, pickling costs more than the extra cores save
+MIN_SHARD_SIZE = 500
+
+# games simulated at once per shard; peak memory scales with this, not sample_size
+CHUNK_SIZE = 5000
+
+# compact the possession loop's working arrays once less than this share of
+# their games are still going
+COMPACT_THRESHOLD = 0.8
+
+# variance reduction modes that pair every game with an antithetic partner, and
+# the ones that share random numbers between matchups (see shared_streams)
+ANTITHETIC_MODES = {VarianceReduction.ANTITHETIC, VarianceReduction.ANTITHETIC_COMMON}
+COMMON_MODES = {VarianceReduction.COMMON, VarianceReduction.ANTITHETIC_COMMON}
+
+# with a tolerance, games are simulated this many per matchup at a time until
+# the home_win_chance_max confidence interval is narrow enough (see
+# simulate_until). CONFIDENCE_Z sets the interval's width, two-sided 95%.
+ADAPTIVE_BATCH_SIZE = int(os.getenv("SIMULATION_ADAPTIVE_BATCH_SIZE", 1000))
+CONFIDENCE_Z = 1.96
+
+# save box scores as packed int16 arrays instead of JSON (see pack_box_score)
+PACK_BOX_SCORES = os.getenv("SIMULATION_PACK_BOX_SCORES", "no") == "yes"
+PACKED_BOX_SCORE_COLUMNS = BOX_SCORE_COLUMNS + ["sim_seconds"]
+PACKED_SECONDS_SCALE = 10
+
+
+class SimulationPool:
+    """Persistent process pool for sharded simulations, one per app worker.
+
+    Simulations are CPU bound, so they never run on the event loop. At most
+    max_running simulations run at once, up to max_queued more wait their turn,
+    and anything past that is turned away with a 503 and a Retry-After header.
+    Background job batches never take more than job_processes of the processes,
+    so requests are never stuck behind a whole season of batches.
+
+    """
+
+    executor: ProcessPoolExecutor = None
+    processes: int = int(
+        os.getenv("SIMULATION_PROCESSES", multiprocessing.cpu_count())
+    )
+    max_running: int = int(os.getenv("SIMULATION_CONCURRENCY", 2))
+    max_queued: int = int(os.getenv("SIMULATION_QUEUE_DEPTH", 8))
+    retry_after: int = int(os.getenv("SIMULATION_RETRY_AFTER", 30))
+    job_processes: int = int(
+        os.getenv("SIMULATION_JOB_PROCESSES", max(1, processes // 2))
+    )
+    in_flight: int = 0
+    semaphore: asyncio.Semaphore = None
+    job_semaphore: asyncio.Semaphore = None
+
+    def shard_count(self, sample_size):
+        return max(1, min(self.processes, sample_size // MIN_SHARD_SIZE))
+
+    async def simulate(self, matchup_df, season, sample_size, *args, **kwargs):
+        """Await run_simulation in a thread, sharded across the process pool."""
+        if self.in_flight >= self.max_running + self.max_queued:
+            raise HTTPException(
+                status_code=503,
+                detail="Simulation queue is full! Try again later.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_running)
+
+        self.in_flight += 1
+        try:
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    None,
+                    partial(
+                        run_simulation,
+                        matchup_df,
+                        season,
+                        sample_size,
+                        *args,
+                        shards=self.shard_count(sample_size),
+                        executor=self.executor,
+                        **kwargs,
+                    ),
+                )
+        finally:
+            self.in_flight -= 1
+
+    async def simulate_batch(self, matchups, season, sample_size, **kwargs):
+        """Await run_batch_simulation on one pool process, for a background job.
+
+        Every job shares the same job_processes slots, so running more jobs
+        doesn't take more of the pool. Batches wait for a slot instead of being
+        turned away.
+
+        """
+        if self.job_semaphore is None:
+            self.job_semaphore = asyncio.Semaphore(self.job_processes)
+
+        async with self.job_semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                partial(run_batch_simulation, matchups, season, sample_size, **kwargs),
+            )
+
+
+simulation_pool = SimulationPool()
+
+
+# every phase of a request that draws random numbers gets its own child stream,
+# so adding draws to one phase never shifts the numbers drawn in another.
+RNG_PHASES = [
+    "simulation",
+    "game_picks",
+    "bracket",
+    "box_scores",
+    "game_sample",
+    "shared_streams",
+    "adaptive",
+]
+
+
+class SeededRNG:
+    """Single RNG factory for a simulation, bracket or game request.
+
+    If no seed is given, a fresh one is drawn so that it can still be recorded
+    and the request replayed later. Seeds fit in a signed 64 bit DB column.
+
+    """
+
+    def __init__(self, seed=None):
+        self.seed = secrets.randbits(63) if seed is None else seed
+
+    def sequence(self, phase):
+        return np.random.SeedSequence(
+            self.seed, spawn_key=(RNG_PHASES.index(phase),)
+        )
+
+    def generator(self, phase):
+        return np.random.default_rng(self.sequence(phase))
+
+    def spawn(self, phase, n_children):
+        return self.sequence(phase).spawn(n_children)
+
+
+async def get_simulation_pool():
+    # spawn instead of fork, so workers don't inherit the event loop or DB engine
+    if simulation_pool.executor is None:
+        simulation_pool.executor = ProcessPoolExecutor(
+            max_workers=simulation_pool.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return simulation_pool
+
+
+async def simulation_pool_shutdown():
+    if simulation_pool.executor is not None:
+        simulation_pool.executor.shutdown()
+        simulation_pool.executor = None
+
+
+def run_simulation(
+    matchup_df,
+    season,
+    sample_size,
+    kenpom_tempo,
+    home_strength,
+    away_strength,
+    seed=None,
+    shards=1,
+    executor=None,
+    chunk_size=CHUNK_SIZE,
+    packed_box_scores=PACK_BOX_SCORES,
+    variance_reduction=VarianceReduction.NONE,
+    tolerance=None,
+):
+    """Simulate sample_size games between the two teams in matchup_df.
+
+    Takes the same inputs as the original pandas array program and returns the
+    same (results_array, distribution_data) pair, ready to be parsed into
+    SimulationRun and SimulationDist models. The seed is recorded with each run,
+    so passing it back in replays the exact same games. matchup_df can also be
+    player_arrays that are already built, like the ones from load_matchups.
+
+    With shards > 1, the games are split into that many independent shards, each
+    with its own child RNG stream, and run on the executor (or one after another
+    if there isn't one). Each shard simulates chunk_size games at a time and only
+    hands back its MarginAccumulator, which are merged before anything is
+    summarized. With packed_box_scores, the saved games come back with a packed
+    box_score blob instead of JSON box scores. variance_reduction picks how the
+    games share random numbers (see shared_streams). Antithetic modes round
+    sample_size up to an even number of games. With a tolerance, sample_size is
+    only the budget, and the games stop once home_win_chance_max is known to
+    within tolerance (see simulate_until). The distribution's sample_size is how
+    many games were actually simulated.
+
+    """
+    players = prepared_player_arrays(matchup_df)
+    batch = matchup_batch([players], [kenpom_tempo], [home_strength], [away_strength])
+
+    streams = SeededRNG(seed)
+    accumulator = simulate_until(
+        batch,
+        1,
+        sample_size,
+        streams,
+        shards,
+        executor,
+        chunk_size,
+        variance_reduction=variance_reduction,
+        tolerance=tolerance,
+    )[0]
+
+    # preserve a subset of runs that will actually be persisted to the database.
+    margins_to_save = accumulator.quantile(EXTRA_QUANTILES)
+    counters, seconds, total_possessions = accumulator.representatives(
+        margins_to_save
+    )
+
+    results_array = box_score_results(
+        players,
+        season,
+        streams.seed,
+        counters,
+        seconds,
+        margins_to_save,
+        total_possessions,
+        packed=packed_box_scores,
+    )
+    distribution_data = margin_distribution(players, season, accumulator)
+
+    return results_array, distribution_data
+
+
+def run_batch_simulation(
+    matchups,
+    season,
+    sample_size,
+    seed=None,
+    shards=1,
+    executor=None,
+    chunk_size=CHUNK_SIZE,
+    variance_reduction=VarianceReduction.NONE,
+    tolerance=None,
+):
+    """Simulate sample_size games for every matchup in one array program.
+
+    matchups is a list of (matchup_df, kenpom_tempo, home_strength, away_strength)
+    tuples, the same inputs run_simulation takes for a single matchup, like the
+    ones load_matchups builds. Rosters are
+    padded into one matchup_batch, so games from different matchups share every
+    possession loop. Only the margin histograms are kept, and the SimulationDist
+    documents come back in the same order as matchups. With a tolerance, each
+    matchup stops on its own once it's close enough, like in run_simulation.
+
+    """
+    players_list = [prepared_player_arrays(matchup_df) for matchup_df, *_ in matchups]
+    _, kenpom_tempos, home_strengths, away_strengths = zip(*matchups)
+    batch = matchup_batch(players_list, kenpom_tempos, home_strengths, away_strengths)
+
+    accumulators = simulate_until(
+        batch,
+        len(matchups),
+        sample_size,
+        SeededRNG(seed),
+        shards,
+        executor,
+        chunk_size,
+        reservoir_size=0,
+        variance_reduction=variance_reduction,
+        tolerance=tolerance,
+    )
+
+    return [
+        margin_distribution(players, season, accumulators[index])
+        for index, players in enumerate(players_list)
+    ]
+
+
+def simulate_until(
+    batch,
+    n_matchups,
+    sample_size,
+    streams,
+    shards,
+    executor,
+    chunk_size,
+    reservoir_size=len(EXTRA_QUANTILES),
+    variance_reduction=VarianceReduction.NONE,
+    tolerance=None,
+):
+    """Simulate up to sample_size games for each of the batch's n_matchups.
+
+    Without a tolerance, every matchup gets all sample_size games in one
+    simulate_batch call. With one, games run ADAPTIVE_BATCH_SIZE at a time for
+    the matchups that are still going, and a matchup stops as soon as the
+    CONFIDENCE_Z interval on its home_win_chance_max is no wider than tolerance
+    either side, or once it's used up sample_size. Lopsided matchups settle
+    after a batch or two. Returns a MarginAccumulator for each matchup index.
+
+    """
+    if tolerance is None:
+        batch_size = sample_size
+    else:
+        batch_size = min(sample_size, ADAPTIVE_BATCH_SIZE)
+
+    # the first batch runs on the request's own streams, every later one on
+    # streams drawn from it, so the seed still replays the exact same games
+    rng = streams.generator("adaptive")
+    accumulators = {}
+    going = np.arange(n_matchups)
+    played = 0
+    while len(going):
+        games = paired_sample_size(
+            min(batch_size, sample_size - played), variance_reduction
+        )
+        # each matchup's games sit next to each other, so a chunk only spans a few
+        for index, accumulator in simulate_batch(
+            batch,
+            np.repeat(going, games),
+            streams if not played else SeededRNG(int(rng.integers(2 ** 63))),
+            shards,
+            executor,
+            chunk_size,
+            reservoir_size=reservoir_size,
+            variance_reduction=variance_reduction,
+        ).items():
+            if index in accumulators:
+                accumulators[index].merge(rng, accumulator)
+            else:
+                accumulators[index] = accumulator
+        played += games
+
+        if played >= sample_size:
+            break
+        # a matchup that's all wins (or all losses) so far has no spread to
+        # measure, so its interval is never narrower than the rule of three's
+        going = going[
+            [
+                max(
+                    CONFIDENCE_Z
+                    * win_chance_error(accumulators[index], -np.inf, np.inf),
+                    3 / played,
+                )
+                > tolerance
+                for index in going
+            ]
+        ]
+
+    return accumulators
+
+
+def simulate_batch(
+    batch,
+    matchup,
+    streams,
+    shards,
+    executor,
+    chunk_size,
+    reservoir_size=len(EXTRA_QUANTILES),
+    variance_reduction=VarianceReduction.NONE,
+):
+    """Run the games in matchup across shards, then merge them by matchup.
+
+    Returns a MarginAccumulator for each matchup index in the batch.
+
+    """
+    # one child stream for merging shards and picking games, plus one per shard
+    rng = streams.generator("game_picks")
+    shard_seeds = streams.spawn("simulation", shards)
+
+    # antithetic pairs are never split up between shards (or chunks)
+    pair_size = 2 if variance_reduction in ANTITHETIC_MODES else 1
+    shard_starts = [
+        pairs[0] if len(pairs) else len(matchup)
+        for pairs in np.array_split(np.arange(0, len(matchup), pair_size), shards)
+    ]
+    shared = shared_streams(streams, matchup, variance_reduction)
+
+    mapper = executor.map if executor is not None else map
+    accumulators = {}
+    for shard_accumulators in mapper(
+        simulate_shard,
+        [batch] * shards,
+        np.split(matchup, shard_starts[1:]),
+        shard_seeds,
+        [chunk_size - chunk_size % pair_size] * shards,
+        [reservoir_size] * shards,
+        [None] * shards
+        if shared is None
+        else [
+            (shared[0], stream, flip)
+            for stream, flip in zip(
+                np.split(shared[1], shard_starts[1:]),
+                np.split(shared[2], shard_starts[1:]),
+            )
+        ],
+    ):
+        for index, accumulator in shard_accumulators.items():
+            accumulators.setdefault(index, MarginAccumulator(reservoir_size)).merge(
+                rng, accumulator
+            )
+
+    return accumulators
+
+
+class MatchupInputCache:
+    """Prepared simulation inputs for each team, so setting up a matchup is a lookup.
+
+    Every entry is a team's team_arrays plus its Kenpom tempo and strength,
+    keyed by (season, team key). Teams missing from the cache are loaded
+    together in one PlayerSeason and one CBBTeam query, and past max_teams the
+    least recently used teams are dropped. The FantasyDataRefresh endpoints
+    invalidate a season whenever they write new data for it. Job batches load
+    their inputs in threads, so the cache is locked while it's used.
+
+    """
+
+    max_teams: int = int(os.getenv("SIMULATION_TEAM_CACHE_SIZE", 1024))
+
+    def __init__(self):
+        self.teams = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, engine, season, team_keys):
+        """{team key: (team_arrays, tempo, strength)} for every key."""
+        with self.lock:
+            missing = [key for key in team_keys if (season, key) not in self.teams]
+            if missing:
+                self.teams.update(self.load(engine, season, missing))
+
+            team_inputs = {}
+            for key in team_keys:
+                self.teams.move_to_end((season, key))
+                team_inputs[key] = self.teams[(season, key)]
+            while len(self.teams) > self.max_teams:
+                self.teams.popitem(last=False)
+
+        return team_inputs
+
+    def load(self, engine, season, team_keys):
+        with Session(engine) as session:
+            player_df = pd.DataFrame(
+                session.execute(
+                    select(PlayerSeasonORM.__table__).where(
+                        (PlayerSeasonORM.Season == season.value)
+                        & PlayerSeasonORM.Team.in_(team_keys)
+                    )
+                )
+                .mappings()
+                .all()
+            )
+            kenpom_df = pd.DataFrame(
+                session.execute(
+                    select(CBBTeamORM.__table__).where(
+                        (CBBTeamORM.Season == season.value)
+                        & CBBTeamORM.Key.in_(team_keys)
+                    )
+                )
+                .mappings()
+                .all()
+            )
+
+        if player_df.empty or kenpom_df.empty:
+            raise HTTPException(status_code=404, detail="No data found!")
+        kenpom_df = kenpom_df.set_index("Key")
+        if not set(team_keys) <= set(player_df["Team"]) & set(kenpom_df.index):
+            raise HTTPException(status_code=404, detail="No data found!")
+
+        # we need some way to normalize for relative strength of teams/conferences,
+        # so Kenpom's SOS AdjEM is scaled to a per-possession point advantage, then
+        # divided by about 5 to target the effect we want
+        return {
+            (season, key): (
+                team_arrays(team_df),
+                kenpom_df.at[key, "AdjT"],
+                kenpom_df.at[key, "OppAdjEM"] / 100 / 5,
+            )
+            for key, team_df in player_df.groupby("Team")
+        }
+
+    def invalidate(self, season):
+        """Drop every cached team for a season."""
+        with self.lock:
+            for key in [key for key in self.teams if key[0] == season]:
+                del self.teams[key]
+
+
+matchup_inputs = MatchupInputCache()
+
+
+def load_matchups(engine, season, matchup_keys):
+    """Build run_batch_simulation's inputs for (away_key, home_key) pairs.
+
+    Every team's inputs come from matchup_inputs, so they're only loaded from the
+    DB once, no matter how many matchups (or requests) they show up in.
+
+    """
+    teams = matchup_inputs.get(
+        engine, season, sorted({key for pair in matchup_keys for key in pair})
+    )
+
+    matchups = []
+    for away_key, home_key in matchup_keys:
+        away, away_tempo, away_strength = teams[away_key]
+        home, home_tempo, home_strength = teams[home_key]
+        # same tempo and strength scaling as a single full_game_simulation
+        matchups.append(
+            (
+                matchup_arrays(away, home),
+                away_tempo + home_tempo,
+                home_strength,
+                away_strength,
+            )
+        )
+
+    return matchups
+
+
+def precompute_matchups(
+    engine,
+    season,
+    matchup_keys,
+    sample_size,
+    seed=None,
+    shards=1,
+    executor=None,
+    variance_reduction=VarianceReduction.NONE,
+    tolerance=None,
+):
+    """Simulate every (away_key, home_key) pair and save their SimulationDist rows.
+
+    Replaces queueing one full_game_simulation request per pair. The whole list
+    runs as one batch and every row goes to the DB in a single bulk upsert, so
+    pairs that were already simulated are replaced. Rows are saved in canonical
+    order, so that's the order they come back in.
+
+    """
+    matchups = load_matchups(engine, season, matchup_keys)
+    distributions = run_batch_simulation(
+        matchups,
+        season,
+        sample_size,
+        seed=seed,
+        shards=shards,
+        executor=executor,
+        variance_reduction=variance_reduction,
+        tolerance=tolerance,
+    )
+    distributions = [canonical_distribution(d) for d in distributions]
+
+    with Session(engine) as session:
+        save_distributions(session, distributions)
+        session.commit()
+
+    return distributions
+
+
+class MarginAccumulator:
+    """Exact histogram of home margins, plus a few representative games for each.
+
+    Every margin keeps a uniform random sample (a reservoir) of up to
+    reservoir_size of its games, as (counters, seconds, possessions) arrays. That's
+    all that's needed to pick the persisted games at the end, so chunks and shards
+    can be folded in and thrown away as they finish. With a reservoir_size of 0,
+    only the histogram is kept. Antithetic games also count their pairs' margins
+    in pair_counts, since their standard errors come from the pairs.
+
+    """
+
+    def __init__(self, reservoir_size=len(EXTRA_QUANTILES)):
+        self.reservoir_size = reservoir_size
+        self.counts = {}
+        self.games = {}
+        self.pair_counts = {}
+
+    def add(self, rng, margins, counters, seconds, possessions, pairs=None):
+        """Fold a chunk of finished games into the histogram and reservoirs.
+
+        pairs holds the (game, antithetic partner) margins of paired games.
+
+        """
+        if pairs is not None:
+            for pair, count in zip(*np.unique(pairs, axis=0, return_counts=True)):
+                pair = (int(pair[0]), int(pair[1]))
+                self.pair_counts[pair] = self.pair_counts.get(pair, 0) + int(count)
+
+        if not self.reservoir_size:
+            for margin, count in zip(*np.unique(margins, return_counts=True)):
+                self.counts[int(margin)] = self.counts.get(int(margin), 0) + int(count)
+            return
+
+        # shuffle, then group by margin, so the first games of each margin are a
+        # uniform sample of that margin's games in this chunk
+        order = rng.permutation(len(margins))
+        order = order[np.argsort(margins[order], kind="stable")]
+        chunk_margins, starts, counts = np.unique(
+            margins[order], return_index=True, return_counts=True
+        )
+        for margin, start, count in zip(chunk_margins, starts, counts):
+            picks = order[start : start + min(count, self.reservoir_size)]
+            self.add_bucket(
+                rng,
+                int(margin),
+                int(count),
+                (counters[picks], seconds[picks], possessions[picks]),
+            )
+
+    def merge(self, rng, other):
+        """Fold another accumulator (usually another shard's) into this one."""
+        for pair, count in other.pair_counts.items():
+            self.pair_counts[pair] = self.pair_counts.get(pair, 0) + count
+        for margin, count in other.counts.items():
+            if not self.reservoir_size:
+                self.counts[margin] = self.counts.get(margin, 0) + count
+                continue
+            self.add_bucket(rng, margin, count, other.games[margin])
+
+    def add_bucket(self, rng, margin, count, games):
+        """Merge a reservoir of games standing in for count games at one margin."""
+        if margin not in self.counts:
+            self.counts[margin] = count
+            self.games[margin] = games
+            return
+
+        # how many of the kept games come from the old reservoir follows the
+        # hypergeometric distribution, which keeps the merged sample uniform
+        old_count = self.counts[margin]
+        keep = min(self.reservoir_size, old_count + count)
+        from_old = rng.hypergeometric(old_count, count, keep)
+        old_picks = rng.choice(len(self.games[margin][0]), from_old, replace=False)
+        new_picks = rng.choice(len(games[0]), keep - from_old, replace=False)
+
+        self.counts[margin] = old_count + count
+        self.games[margin] = tuple(
+            np.concatenate([old[old_picks], new[new_picks]])
+            for old, new in zip(self.games[margin], games)
+        )
+
+    def histogram(self):
+        """Sorted margins and how many games ended with each."""
+        margins = np.array(sorted(self.counts))
+        return margins, np.array([self.counts[margin] for margin in margins])
+
+    def pair_histogram(self):
+        """Distinct (game, partner) margin pairs and how many pairs had each."""
+        pairs = np.array(sorted(self.pair_counts), dtype=int).reshape(-1, 2)
+        return pairs, np.array([self.pair_counts[tuple(pair)] for pair in pairs])
+
+    def quantile(self, q):
+        """Nearest rank quantiles, same as pandas' interpolation="nearest"."""
+        margins, counts = self.histogram()
+        ranks = np.around(np.asarray(q) * (counts.sum() - 1)).astype(int)
+        return margins[np.searchsorted(np.cumsum(counts), ranks, side="right")]
+
+    def representatives(self, margins):
+        """One kept game per requested margin, without repeats where possible."""
+        used = {}
+        picks = []
+        for margin in margins:
+            games = self.games[margin]
+            pick = used.get(margin, 0) % len(games[0])
+            used[margin] = used.get(margin, 0) + 1
+            picks.append(tuple(array[pick] for array in games))
+        return (np.stack(arrays) for arrays in zip(*picks))
+
+
+def player_arrays(matchup_df):
+    """Pull the per-player season columns the simulation needs into arrays.
+
+    Players are sorted away team first, then by PlayerID, which is the order they
+    appear in every box score. Team index 0 is the away team and 1 is home.
+
+    Everything here is fixed for the matchup, so it's built once per simulation
+    and shared by every shard and chunk. The event rates are packed into two
+    contiguous (players x events) tables, so a possession only needs one lookup
+    and one exp per side of the ball.
+
+    """
+    return matchup_arrays(
+        team_arrays(matchup_df[matchup_df["designation"] == "away"]),
+        team_arrays(matchup_df[matchup_df["designation"] == "home"]),
+    )
+
+
+def prepared_player_arrays(matchup_df):
+    """player_arrays for matchup_df, unless it's already been prepared."""
+    if isinstance(matchup_df, dict):
+        return matchup_df
+    return player_arrays(matchup_df)
+
+
+def team_arrays(team_df):
+    """One team's half of player_arrays, sorted by PlayerID.
+
+    None of it depends on the opponent, so it's what MatchupInputCache keeps for
+    each team.
+
+    """
+    team_df = team_df.sort_values(by="PlayerID")
+    minutes = team_df["Minutes"].to_numpy(dtype=float)
+
+    # minutes for each player, divided by total minutes played for the team
+    minute_dist = minutes / minutes.sum()
+    # lineup draws start from the log weights, so only take them once
+    with np.errstate(divide="ignore"):
+        log_minute_dist = np.log(minute_dist)
+
+    # exponential rate parameter for each event type (events per second).
+    # factor of 2 because each team only has the ball for about half the game,
+    # so this converts events per game second to events per possession second.
+    def per_second(columns):
+        return np.ascontiguousarray(
+            np.divide(
+                2 * team_df[columns].to_numpy(dtype=float),
+                minutes[:, None] * 60,
+                out=np.zeros((len(minutes), len(columns))),
+                where=minutes[:, None] > 0,
+            )
+        )
+
+    return {
+        "team_key": team_df["Team"].iloc[0],
+        "minute_dist": minute_dist,
+        "log_minute_dist": log_minute_dist,
+        "defense_rates": per_second(DEFENSE_RATE_COLUMNS),
+        "offense_rates": per_second(OFFENSE_RATE_COLUMNS),
+        "shot_weight": team_df["FieldGoalsAttempted"].to_numpy(dtype=float),
+        "off_reb_weight": team_df["OffensiveRebounds"].to_numpy(dtype=float),
+        "def_reb_weight": team_df["DefensiveRebounds"].to_numpy(dtype=float),
+        "two_attempt_chance": team_df["two_attempt_chance"].to_numpy(dtype=float),
+        "two_chance": team_df["two_chance"].to_numpy(dtype=float),
+        "three_chance": team_df["three_chance"].to_numpy(dtype=float),
+        "ft_chance": team_df["ft_chance"].to_numpy(dtype=float),
+        "player_ids": team_df["PlayerID"].to_numpy(),
+        "names": team_df["Name"].to_numpy(),
+        "positions": team_df["Position"].to_numpy(),
+    }
+
+
+def matchup_arrays(away, home):
+    """player_arrays for a matchup, put together from each team's team_arrays."""
+    team_index = np.repeat(
+        np.array([0, 1], dtype=np.int8),
+        [len(away["minute_dist"]), len(home["minute_dist"])],
+    )
+
+    def stack(key):
+        return np.concatenate([away[key], home[key]])
+
+    return {
+        "team_keys": [away["team_key"], home["team_key"]],
+        "team_index": team_index,
+        "slots": [np.flatnonzero(team_index == 0), np.flatnonzero(team_index == 1)],
+        "minute_dist": stack("minute_dist"),
+        "log_minute_dist": [away["log_minute_dist"], home["log_minute_dist"]],
+        "defense_rates": stack("defense_rates"),
+        "offense_rates": stack("offense_rates"),
+        "shot_weight": stack("shot_weight"),
+        "off_reb_weight": stack("off_reb_weight"),
+        "def_reb_weight": stack("def_reb_weight"),
+        "two_attempt_chance": stack("two_attempt_chance"),
+        "two_chance": stack("two_chance"),
+        "three_chance": stack("three_chance"),
+        "ft_chance": stack("ft_chance"),
+        "index": pd.MultiIndex.from_arrays(
+            [
+                np.repeat([away["team_key"], home["team_key"]], np.bincount(team_index)),
+                stack("player_ids"),
+            ],
+            names=["Team", "PlayerID"],
+        ),
+        "names": stack("names"),
+        "positions": stack("positions"),
+    }
+
+
+def matchup_batch(players_list, kenpom_tempos, home_strengths, away_strengths):
+    """Stack player_arrays for several matchups along a leading matchup axis.
+
+    Rosters are padded out to the biggest one in the batch. Padded players have no
+    minutes, so they never make a lineup and never get credited with anything.
+    The per-matchup tempo and strength scalars ride along, so the possession loop
+    can look everything up by (matchup, player slot).
+
+    """
+    n_players = max(len(players["team_index"]) for players in players_list)
+    n_team_players = max(
+        len(slots) for players in players_list for slots in players["slots"]
+    )
+
+    def pad(key, width, fill=0.0, team=None):
+        arrays = [
+            players[key] if team is None else players[key][team]
+            for players in players_list
+        ]
+        padded = np.full(
+            (len(arrays), width) + arrays[0].shape[1:], fill, dtype=arrays[0].dtype
+        )
+        for matchup, array in enumerate(arrays):
+            padded[matchup, : len(array)] = array
+        return padded
+
+    # normal mean 15 and stdev 4 yields about 140 possessions a game.
+    # so let's adjust the normal dist mean by 140 / kenpomtempo
+    # (this makes possessions longer if tempo is less than 140)
+    tempo_factor = 140 / np.asarray(kenpom_tempos, dtype=float)
+
+    return {
+        "n_players": n_players,
+        "slots": [pad("slots", n_team_players, 0, team) for team in (0, 1)],
+        "log_minute_dist": [
+            pad("log_minute_dist", n_team_players, -np.inf, team) for team in (0, 1)
+        ],
+        "defense_rates": pad("defense_rates", n_players),
+        "offense_rates": pad("offense_rates", n_players),
+        "shot_weight": pad("shot_weight", n_players),
+        "off_reb_weight": pad("off_reb_weight", n_players),
+        "def_reb_weight": pad("def_reb_weight", n_players),
+        "two_attempt_chance": pad("two_attempt_chance", n_players),
+        "two_chance": pad("two_chance", n_players),
+        "three_chance": pad("three_chance", n_players),
+        "ft_chance": pad("ft_chance", n_players),
+        "possession_length_mean": 15 * tempo_factor,
+        "possession_length_stdev": 4 * tempo_factor,
+        # relative strength of the away (0) and home (1) teams
+        "strengths": np.column_stack([away_strengths, home_strengths]),
+    }
+
+
+def simulate_shard(
+    batch,
+    matchup,
+    seed_sequence,
+    chunk_size=CHUNK_SIZE,
+    reservoir_size=len(EXTRA_QUANTILES),
+    shared=None,
+):
+    """Run one shard of a simulation on its own RNG stream (picklable entrypoint).
+
+    matchup holds the batch's matchup index for each of the shard's games. Games
+    are simulated chunk_size at a time and folded into one MarginAccumulator per
+    matchup, so only one chunk's box scores are ever held in memory. shared is
+    the shard's slice of shared_streams, if the games share random numbers.
+
+    """
+    rng = np.random.default_rng(seed_sequence)
+    accumulators = {}
+    for start in range(0, len(matchup), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_shared = None
+        if shared is not None:
+            key, stream, flip = shared
+            chunk_shared = (key, stream[chunk], flip[chunk])
+        counters, seconds, total_possessions, scores = simulate_games(
+            batch, matchup[chunk], rng, chunk_shared
+        )
+        margins = scores[:, 1] - scores[:, 0]
+        for index in np.unique(matchup[chunk]):
+            games = matchup[chunk] == index
+            pairs = None
+            if chunk_shared is not None and chunk_shared[2][games].any():
+                # each unflipped game sits right before its flipped partner
+                flipped = chunk_shared[2][games]
+                pairs = np.column_stack(
+                    [margins[games][~flipped], margins[games][flipped]]
+                )
+            accumulators.setdefault(
+                int(index), MarginAccumulator(reservoir_size)
+            ).add(
+                rng,
+                margins[games],
+                counters[games],
+                seconds[games],
+                total_possessions[games],
+                pairs,
+            )
+    return accumulators
+
+
+def paired_sample_size(sample_size, variance_reduction):
+    """Antithetic modes play games in pairs, so round up to an even number."""
+    if variance_reduction in ANTITHETIC_MODES:
+        return sample_size + sample_size % 2
+    return sample_size
+
+
+def shared_streams(streams, matchup, variance_reduction):
+    """StreamDraws' (key, stream, flip) for every game, None if they're independent.
+
+    Antithetic modes pair up each matchup's games in order, with the second game
+    of every pair flipped, so the two teams trade luck between the pair. Common
+    random number modes put the nth game (or pair) of every matchup on the same
+    stream, so matchups are compared on the same luck. Every shard draws from
+    the same key, so streams line up across shards and chunks.
+
+    """
+    if variance_reduction == VarianceReduction.NONE:
+        return None
+
+    # each game's place among its matchup's games, which sit next to each other
+    starts = np.flatnonzero(np.r_[True, matchup[1:] != matchup[:-1]])
+    rank = np.arange(len(matchup)) - np.repeat(
+        starts, np.diff(np.r_[starts, len(matchup)])
+    )
+
+    flip = np.zeros(len(matchup), dtype=bool)
+    if variance_reduction in ANTITHETIC_MODES:
+        flip = rank % 2 == 1
+        rank = rank // 2
+    if variance_reduction in COMMON_MODES:
+        stream = rank
+    else:
+        # every game (or pair) gets a stream of its own
+        stream = np.cumsum(~flip) - 1
+
+    key = streams.sequence("shared_streams").generate_state(1, dtype=np.uint64)[0]
+    return key, stream, flip
+
+
+def simulate_games(batch, matchup, rng, shared=None):
+    """Possession loop. Returns box score counters, seconds, possession counts
+    and final scores.
+
+    batch comes from matchup_batch, and matchup holds the batch's matchup index
+    for each game, so one call can cover games from any number of matchups.
+    With shared, a (key, stream, flip) slice of shared_streams, games share
+    their random numbers through StreamDraws instead of drawing their own.
+
+    counters is an int array shaped (simulations x players x BOX_SCORE_COLUMNS),
+    seconds is a float array shaped (simulations x players) and scores is an int
+    array shaped (simulations x 2), away team first.
+
+    The loop only works on the games that are still going. Once enough of them
+    are over, finished games are copied out to the returned arrays and dropped
+    from the working arrays, so the overtime tail only pays for overtime games.
+
+    """
+    sample_size = len(matchup)
+    n_players = batch["n_players"]
+    rng = GameDraws(rng) if shared is None else StreamDraws(*shared)
+
+    # returned arrays, filled in as games finish
+    game_counters = np.zeros(
+        (sample_size, n_players, len(BOX_SCORE_COLUMNS)), np.int32
+    )
+    game_seconds = np.zeros((sample_size, n_players))
+    game_possessions = np.zeros(sample_size, dtype=np.int16)
+    game_scores = np.zeros((sample_size, 2), np.int32)
+
+    # working arrays for the games still being played. active maps each working
+    # row back to its game.
+    active = np.arange(sample_size)
+    counters = np.zeros((sample_size, n_players, len(BOX_SCORE_COLUMNS)), np.int32)
+    seconds = np.zeros((sample_size, n_players))
+    # running away/home score, credited along with the shots and free throws
+    scores = np.zeros((sample_size, 2), np.int32)
+    strengths = batch["strengths"]
+
+    # who has the ball in each game (simple 50/50 to start)
+    offense = rng.tip_off(sample_size)
+    finished = np.zeros(sample_size, dtype=bool)
+
+    # game clock array, shot clock reset array, possession length array,
+    # possession counter for each simulation
+    time_remaining = np.full(sample_size, 60.0 * 40)
+    shot_clock_reset = np.ones(sample_size, dtype=bool)
+    possession_length = np.zeros(sample_size)
+    total_possessions = np.zeros(sample_size, dtype=np.int16)
+    possession_length_mean = batch["possession_length_mean"]
+    possession_length_stdev = batch["possession_length_stdev"]
+
+    while True:
+        # if there was a shot clock reset, this will add a possession to that game
+        total_possessions += shot_clock_reset
+
+        # games out of time might be over. if tied, start a 5 minute overtime.
+        to_resolve = (time_remaining <= 0) & ~finished
+        if to_resolve.any():
+            tied = scores[:, 0] == scores[:, 1]
+            time_remaining[to_resolve & tied] = 60 * 5
+            finished[to_resolve & ~tied] = True
+            shot_clock_reset[finished] = False
+
+        # once enough games are over, copy them out and drop them from the
+        # working arrays. if there's no time left in any game, the loop ends.
+        if finished.sum() > (1 - COMPACT_THRESHOLD) * len(active):
+            done = active[finished]
+            game_counters[done] = counters[finished]
+            game_seconds[done] = seconds[finished]
+            game_possessions[done] = total_possessions[finished]
+            game_scores[done] = scores[finished]
+            if finished.all():
+                break
+
+            still_going = ~finished
+            rng = rng.keep(still_going)
+            (
+                active,
+                matchup,
+                counters,
+                seconds,
+                scores,
+                offense,
+                finished,
+                time_remaining,
+                shot_clock_reset,
+                possession_length,
+                total_possessions,
+            ) = (
+                array[still_going]
+                for array in (
+                    active,
+                    matchup,
+                    counters,
+                    seconds,
+                    scores,
+                    offense,
+                    finished,
+                    time_remaining,
+                    shot_clock_reset,
+                    possession_length,
+                    total_possessions,
+                )
+            )
+
+        n_active = len(active)
+        rows = np.arange(n_active)
+        lineup_matchup = matchup[:, None]
+        rng.next_turn(offense)
+
+        # events can only happen in games that are still going. this gets switched
+        # off for the rest of the possession as each game's possession resolves.
+        eligible = ~finished
+        flip = np.zeros(n_active, dtype=bool)
+        rebound_situation = np.zeros(n_active, dtype=bool)
+        assist_situation = np.zeros(n_active, dtype=bool)
+
+        # fresh possession length after a shot clock reset. otherwise, use a
+        # squished distribution based on the previous possession's length.
+        fresh_possession_length = rng.normal(
+            loc=possession_length_mean[matchup],
+            scale=possession_length_stdev[matchup],
+            size=n_active,
+        )
+        recycled_possession_length = rng.normal(
+            loc=possession_length_mean[matchup] * ((30 - possession_length) / 30),
+            scale=possession_length_stdev[matchup] * ((30 - possession_length) / 30),
+            size=n_active,
+        )
+        # cap at 29 seconds so the recycled distribution doesn't blow up with a
+        # negative scale parameter, and never run past the end of the game.
+        possession_length = np.clip(
+            np.where(
+                shot_clock_reset, fresh_possession_length, recycled_possession_length
+            ),
+            0,
+            np.minimum(29, time_remaining),
+        )
+        possession_length[finished] = 0
+
+        # pick 10 players for the current possession based on average time share
+        lineups = sample_lineups(rng, batch, matchup)
+        offense_five = lineups[rows, offense]
+        defense_five = lineups[rows, 1 - offense]
+        offensive_strengths = strengths[matchup, offense]
+        defensive_strengths = strengths[matchup, 1 - offense]
+
+        # add the possession length to the time played for everyone on the floor
+        seconds[rows[:, None], lineups.reshape(n_active, 10)] += possession_length[
+            :, None
+        ]
+
+        # exponential CDF per player for this possession, for every event type
+        # at once. the division by given probabilities happens below.
+        exposure = possession_length[:, None, None]
+        defense_chances = 1 - np.exp(
+            -exposure * batch["defense_rates"][lineup_matchup, defense_five]
+        )
+        offense_chances = 1 - np.exp(
+            -exposure * batch["offense_rates"][lineup_matchup, offense_five]
+        )
+        steal_chances = defense_chances[..., STEAL_RATE]
+        turnover_chances = offense_chances[..., TURNOVER_RATE]
+        team_steal_chances = 1 - np.prod(1 - steal_chances, axis=1)
+        team_turnover_chances = 1 - np.prod(1 - turnover_chances, axis=1)
+
+        # the steal/turnover check! we're modeling them as independent.
+        # RNG is also where we apply relative team/conference strength.
+        steal_turnover_success = rng.random(size=n_active) - defensive_strengths
+        steal_games = np.flatnonzero(
+            (steal_turnover_success < team_steal_chances) & eligible
+        )
+        turnover_games = np.flatnonzero(
+            (steal_turnover_success < team_turnover_chances) & eligible
+        )
+        credit_event(
+            rng, counters, STEALS, steal_games, defense_five, steal_chances
+        )
+        credit_event(
+            rng, counters, TURNOVERS, turnover_games, offense_five, turnover_chances
+        )
+
+        # turnovers flip possession and end this possession's events
+        flip[turnover_games] = True
+        eligible[turnover_games] = False
+
+        # non-shooting or shooting foul check, given no turnover. strength is
+        # ADDED here, so a weaker team is more likely to commit a foul.
+        given_probabilities = 1 - team_turnover_chances
+        with np.errstate(divide="ignore", invalid="ignore"):
+            foul_chances = (
+                defense_chances[..., FOUL_RATE] / given_probabilities[:, None]
+            )
+        team_foul_chances = 1 - np.prod(1 - foul_chances, axis=1)
+        foul_occurred_rng = rng.random(size=n_active) + defensive_strengths
+        foul_occurrences = (foul_occurred_rng < team_foul_chances) & eligible
+        credit_event(
+            rng,
+            counters,
+            FOULS,
+            np.flatnonzero(foul_occurrences),
+            defense_five,
+            foul_chances,
+        )
+
+        # non-shooting fouls (50/50 for now) restart the loop without a change of
+        # possession. shooting fouls go to the line.
+        non_shooting_foul_check = rng.integers(2, size=n_active).astype(bool)
+        non_shooting_fouls = foul_occurrences & non_shooting_foul_check
+        shooting_fouls = foul_occurrences & ~non_shooting_foul_check
+        eligible[non_shooting_fouls] = False
+
+        # sample the shooter in each game. a shot can't happen in a game that
+        # already had a turnover or non-shooting foul.
+        shooter_columns = pick_players(
+            rng, batch["shot_weight"][lineup_matchup, offense_five]
+        )
+        shooters = offense_five[rows, shooter_columns]
+        attempted = eligible.copy()
+
+        # block check, given no turnover
+        with np.errstate(divide="ignore", invalid="ignore"):
+            block_chances = (
+                defense_chances[..., BLOCK_RATE] / given_probabilities[:, None]
+            )
+        team_block_chances = 1 - np.prod(1 - block_chances, axis=1)
+        block_success_rng = rng.random(size=n_active) - defensive_strengths
+        blocks = (block_success_rng < team_block_chances) & eligible
+        credit_event(
+            rng, counters, BLOCKS, np.flatnonzero(blocks), defense_five, block_chances
+        )
+
+        # blocked shots can't go in, and half of them stay in bounds for a rebound
+        eligible[blocks] = False
+        block_inb_check = rng.integers(2, size=n_active).astype(bool)
+        rebound_situation[blocks & block_inb_check] = True
+        blocks_oob = blocks & ~block_inb_check
+
+        # the shot type check!
+        two_or_three_rng = rng.random(size=n_active)
+        is_three = two_or_three_rng > batch["two_attempt_chance"][matchup, shooters]
+        two_attempts = attempted & ~is_three
+        three_attempts = attempted & is_three
+
+        given_probabilities = given_probabilities * (1 - team_block_chances)
+
+        # time to see if the shots went in
+        shot_success_rng = rng.random(size=n_active) - offensive_strengths
+        successful_twos = (
+            two_attempts
+            & (shot_success_rng < batch["two_chance"][matchup, shooters])
+            & eligible
+        )
+        successful_threes = (
+            three_attempts
+            & (shot_success_rng < batch["three_chance"][matchup, shooters])
+            & eligible
+        )
+        successful_shots = successful_twos | successful_threes
+        missed_twos = two_attempts & ~successful_twos
+        missed_threes = three_attempts & ~successful_threes
+
+        # free throws: and-ones get one, missed shots get two or three
+        ft_attempts = shooting_fouls * (
+            successful_shots * 1 + missed_twos * 2 + missed_threes * 3
+        )
+        ft_made = rng.binomial(n=ft_attempts, p=batch["ft_chance"][matchup, shooters])
+
+        # missed shots where the shooter was fouled don't count as an attempt
+        shooter_counts = counters[rows, shooters]
+        shooter_counts[:, TWO_ATTEMPTED] += two_attempts & ~(shooting_fouls & missed_twos)
+        shooter_counts[:, THREE_ATTEMPTED] += three_attempts & ~(
+            shooting_fouls & missed_threes
+        )
+        shooter_counts[:, TWO_MADE] += successful_twos
+        shooter_counts[:, THREE_MADE] += successful_threes
+        shooter_counts[:, FT_ATTEMPTED] += ft_attempts
+        shooter_counts[:, FT_MADE] += ft_made
+        counters[rows, shooters] = shooter_counts
+        scores[rows, offense] += successful_twos * 2 + successful_threes * 3 + ft_made
+
+        # made shots flip possession and might have an assist. missed shots go
+        # to a rebound, unless the block went out of bounds or there was a
+        # shooting foul (we assume a change of possession after free throws).
+        flip[successful_shots] = True
+        assist_situation[successful_shots] = True
+        missed_shots = missed_twos | missed_threes
+        eligible[missed_shots] = False
+        rebound_situation[missed_shots] = True
+        rebound_situation[blocks_oob] = False
+        rebound_situation[shooting_fouls] = False
+        flip[shooting_fouls] = True
+
+        # assist check, given a made shot
+        made_shot_probs = np.where(
+            is_three,
+            batch["three_chance"][matchup, shooters],
+            batch["two_chance"][matchup, shooters],
+        )
+        given_probabilities = given_probabilities * made_shot_probs
+        with np.errstate(divide="ignore", invalid="ignore"):
+            assist_chances = (
+                offense_chances[..., ASSIST_RATE] / given_probabilities[:, None]
+            )
+        assist_chances[np.isposinf(assist_chances)] = 1
+        team_assist_chances = 1 - np.prod(1 - assist_chances, axis=1)
+        assist_success_rng = rng.random(size=n_active) - offensive_strengths
+        assists = (assist_success_rng < team_assist_chances) & assist_situation
+        credit_event(
+            rng,
+            counters,
+            ASSISTS,
+            np.flatnonzero(assists),
+            offense_five,
+            assist_chances,
+        )
+
+        # finally, rebound situations. who gets the rebound?
+        off_reb_weights = batch["off_reb_weight"][lineup_matchup, offense_five]
+        def_reb_weights = batch["def_reb_weight"][lineup_matchup, defense_five]
+        off_reb_totals = off_reb_weights.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            team_off_reb_chances = off_reb_totals / (
+                off_reb_totals + def_reb_weights.sum(axis=1)
+            )
+        off_reb_rng = rng.random(size=n_active) - offensive_strengths
+        off_rebs = (off_reb_rng < team_off_reb_chances) & rebound_situation
+        def_rebs = (off_reb_rng >= team_off_reb_chances) & rebound_situation
+        flip[def_rebs] = True
+        credit_event(
+            rng,
+            counters,
+            OFF_REBOUNDS,
+            np.flatnonzero(off_rebs),
+            offense_five,
+            off_reb_weights,
+        )
+        credit_event(
+            rng,
+            counters,
+            DEF_REBOUNDS,
+            np.flatnonzero(def_rebs),
+            defense_five,
+            def_reb_weights,
+        )
+
+        # update clocks, change possession, and reset the shot clock
+        time_remaining -= possession_length
+        offense = np.where(flip, 1 - offense, offense)
+        shot_clock_reset = flip
+
+    return game_counters, game_seconds, game_possessions, game_scores
+
+
+class GameDraws:
+    """Random draws for simulate_games, one per game still being played.
+
+    Every call goes straight to the Generator, so independent games draw the
+    same numbers they always have. keep and subset follow the possession loop
+    as it drops finished games and credits events to some of the games.
+
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def random(self, size):
+        return self.rng.random(size=size)
+
+    def integers(self, high, size):
+        return self.rng.integers(high, size=size)
+
+    def tip_off(self, size):
+        return self.rng.integers(2, size=size)
+
+    def normal(self, loc, scale, size):
+        return self.rng.normal(loc=loc, scale=scale, size=size)
+
+    def gumbel(self, size):
+        return self.rng.gumbel(size=size)
+
+    def binomial(self, n, p):
+        return self.rng.binomial(n=n, p=p)
+
+    def next_turn(self, offense):
+        pass
+
+    def keep(self, games):
+        return self
+
+    def subset(self, games):
+        return self
+
+
+class StreamDraws(GameDraws):
+    """GameDraws where a game's uniforms are a hash of where it is in the game.
+
+    Every draw is keyed by the game's stream, the team on offense, how many
+    turns that team has had, and which draw of the turn it is, so two games on
+    the same stream get the same numbers on each team's nth turn even after
+    their possessions fall out of step. Flipped games swap the teams in that
+    key, for antithetic pairs. Every other distribution is an inverse CDF of
+    those uniforms, so any game's draws only depend on its own key.
+
+    """
+
+    def __init__(self, key, stream, flip):
+        self.key = np.uint64(key)
+        self.stream = stream.astype(np.uint64)
+        self.flip = flip
+        self.turns = np.zeros((len(stream), 2), dtype=np.uint64)
+        # the tip-off is turn 0, before either team has the ball
+        self.turn_keys = splitmix(splitmix(self.key + self.stream))
+        self.draws = 0
+
+    def tip_off(self, size):
+        # flipped games give the ball to the other team
+        return ((self.random(size) < 0.5) ^ self.flip).astype(np.int64)
+
+    def next_turn(self, offense):
+        """Start the offense's next turn in every game.
+
+        Flipped games key each team's turns by the other team, so each side
+        gets the luck its opponent had in the game it's paired with.
+
+        """
+        rows = np.arange(len(offense))
+        self.turns[rows, offense] += np.uint64(1)
+        self.turn_keys = splitmix(
+            splitmix(self.key + self.stream)
+            + self.turns[rows, offense] * np.uint64(2)
+            + (offense ^ self.flip).astype(np.uint64)
+        )
+        self.draws = 0
+
+    def random(self, size):
+        shape = tuple(np.atleast_1d(size)[1:])
+        columns = np.arange(np.prod(shape, dtype=np.intp), dtype=np.uint64)
+        self.draws += 1
+        bits = splitmix(
+            self.turn_keys[:, None] + np.uint64(self.draws << 32) + columns
+        ).reshape((len(self.turn_keys),) + shape)
+        return (bits >> np.uint64(11)) * 2.0 ** -53
+
+    def integers(self, high, size):
+        return np.minimum(self.random(size) * high, high - 1).astype(np.int64)
+
+    def normal(self, loc, scale, size):
+        return loc + scale * ndtri(self.random(size))
+
+    def gumbel(self, size):
+        with np.errstate(divide="ignore"):
+            return -np.log(-np.log(self.random(size)))
+
+    def binomial(self, n, p):
+        trials = np.arange(n.max(initial=0))
+        made = (trials < n[:, None]) & (self.random((len(n), len(trials))) < p[:, None])
+        return made.sum(axis=1)
+
+    def keep(self, games):
+        kept = StreamDraws.__new__(StreamDraws)
+        kept.key = self.key
+        kept.stream = self.stream[games]
+        kept.flip = self.flip[games]
+        kept.turns = self.turns[games]
+        kept.turn_keys = self.turn_keys[games]
+        kept.draws = self.draws
+        return kept
+
+    def subset(self, games):
+        subset = self.keep(games)
+        # the subset's draw uses up one of the turn's, so later draws line up
+        self.draws += 1
+        return subset
+
+
+def splitmix(x):
+    """SplitMix64's finalizer: a well mixed uint64 hash of each uint64 in x."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def sample_lineups(rng, batch, matchup):
+    """Pick five players per team in every simulation based on average time share.
+
+    Returns an array of player slots shaped (simulations x 2 x 5), with the away
+    team first.
+
+    """
+    return np.stack(
+        [
+            np.take_along_axis(
+                batch["slots"][team][matchup],
+                gumbel_top_k(
+                    rng, batch["log_minute_dist"][team][matchup], len(matchup), 5
+                ),
+                axis=1,
+            )
+            for team in (0, 1)
+        ],
+        axis=1,
+    )
+
+
+def gumbel_top_k(rng, log_weights, size, k):
+    """Draw k items without replacement by weight, size times over.
+
+    Uses the Gumbel-top-k trick: adding Gumbel noise to the log weights and
+    keeping the k largest keys is the same draw as picking one item at a time
+    proportional to its weight, but happens in a single vectorized call.
+
+    """
+    keys = log_weights + rng.gumbel(size=(size, log_weights.shape[-1]))
+    return np.argpartition(-keys, k - 1, axis=1)[:, :k]
+
+
+def pick_players(rng, weights):
+    """Pick one column per row of a (games x 5) weight matrix.
+
+    Each row is sampled from its own weights with a single uniform draw against
+    the row's cumulative sums, so every game is resolved in one vectorized pass.
+    Weights don't need to be normalized.
+
+    """
+    cumulative_weights = np.cumsum(weights, axis=1)
+    draws = rng.random(size=len(weights)) * cumulative_weights[:, -1]
+    return np.minimum(
+        (cumulative_weights <= draws[:, None]).sum(axis=1), weights.shape[1] - 1
+    )
+
+
+def credit_event(rng, counters, column, games, five, weights):
+    """Credit one event to one of the five players in each of the given games."""
+    # the draw is used up even with no games, so shared streams stay in step
+    rng = rng.subset(games)
+    if not len(games):
+        return
+    picked = pick_players(rng, weights[games])
+    counters[games, five[games, picked], column] += 1
+
+
+def points_by_team(players, counters):
+    """Points scored by the away and home teams, shaped (simulations x 2)."""
+    player_points = (
+        counters[..., FT_MADE]
+        + counters[..., TWO_MADE] * 2
+        + counters[..., THREE_MADE] * 3
+    )
+    return np.stack(
+        [
+            player_points[:, players["team_index"] == 0].sum(axis=1),
+            player_points[:, players["team_index"] == 1].sum(axis=1),
+        ],
+        axis=1,
+    )
+
+
+def box_score_results(
+    players,
+    season,
+    seed,
+    counters,
+    seconds,
+    margins,
+    total_possessions,
+    packed=False,
+):
+    """Build the box score documents for the games being persisted.
+
+    Every array only holds the games being saved, one per document. With packed,
+    each game's box score is a pack_box_score blob instead of JSON.
+
+    """
+    saved_sims = np.arange(len(margins))
+    game_summaries = [
+        {
+            "season": season.value,
+            "away_key": players["team_keys"][0],
+            "home_key": players["team_keys"][1],
+            "neutral_site": True,
+            "home_margin": int(margins[sim]),
+            "total_possessions": int(total_possessions[sim]),
+        }
+        for sim in saved_sims
+    ]
+
+    if packed:
+        return [
+            {
+                "game_summary": game_summaries[sim],
+                "box_score": pack_box_score(players, counters[sim], seconds[sim]),
+                "seed": seed,
+            }
+            for sim in saved_sims
+        ]
+
+    box_scores = box_score_documents(
+        players["index"].get_level_values("Team"),
+        players["index"].get_level_values("PlayerID"),
+        players["names"],
+        players["positions"],
+        counters,
+        seconds,
+    )
+
+    return [
+        {
+            "game_summary": game_summaries[sim],
+            "team_box_score": box_scores[sim][0],
+            "full_box_score": box_scores[sim][1],
+            "seed": seed,
+        }
+        for sim in saved_sims
+    ]
+
+
+def box_score_documents(teams, player_ids, names, positions, counters, seconds):
+    """(team_box_score, full_box_score) JSON for each game in a stack of games.
+
+    counters is shaped (games x players x BOX_SCORE_COLUMNS) and seconds (games x
+    players). Players are keyed by their (Team, PlayerID) tuple as a string and
+    teams by key, same as pandas keyed them. Team totals are summed in NumPy and
+    every array is converted with one tolist, so pandas never gets involved.
+
+    """
+    teams = np.asarray(teams, dtype=object)
+    player_keys = [
+        str(player_key) for player_key in zip(teams.tolist(), np.asarray(player_ids).tolist())
+    ]
+    team_keys = sorted(set(teams.tolist()))
+    team_players = np.stack([teams == team for team in team_keys]).astype(np.int64)
+
+    # sim_points goes after the counters, and sim_minutes after that
+    points = (
+        counters[..., FT_MADE]
+        + counters[..., TWO_MADE] * 2
+        + counters[..., THREE_MADE] * 3
+    )
+    stats = np.concatenate([counters, points[..., None]], axis=-1).astype(np.int64)
+    stat_columns = BOX_SCORE_COLUMNS + ["sim_points"]
+    team_stats = np.einsum("tp,gps->gts", team_players, stats)
+    team_seconds = seconds @ team_players.T
+
+    def box_score(name_position, game_seconds, game_stats):
+        return {
+            **name_position,
+            "sim_seconds": game_seconds,
+            **dict(zip(stat_columns, game_stats)),
+            "sim_minutes": game_seconds / 60,
+        }
+
+    players = [
+        {"Name": name, "Position": position}
+        for name, position in zip(list(names), list(positions))
+    ]
+    return [
+        (
+            {
+                team: box_score({}, *team_box_score)
+                for team, *team_box_score in zip(
+                    team_keys, game_team_seconds, game_team_stats
+                )
+            },
+            {
+                player_key: box_score(player, *player_box_score)
+                for player_key, player, *player_box_score in zip(
+                    player_keys, players, game_seconds, game_stats
+                )
+            },
+        )
+        for game_seconds, game_stats, game_team_seconds, game_team_stats in zip(
+            seconds.tolist(), stats.tolist(), team_seconds.tolist(), team_stats.tolist()
+        )
+    ]
+
+
+def pack_box_score(players, counters, seconds):
+    """One game's box score as bytes: a roster header, then an int16 stat table.
+
+    The first four bytes are the little-endian length of the header, a JSON
+    object with the two team keys and each player slot's team (0 away, 1 home)
+    and PlayerID. Names and positions are left to PlayerSeason. The rest is a
+    (players x PACKED_BOX_SCORE_COLUMNS) little-endian int16 array, with
+    sim_seconds kept in tenths of a second so it fits.
+
+    """
+    header = orjson.dumps(
+        {
+            "teams": list(players["team_keys"]),
+            "team_index": players["team_index"].tolist(),
+            "PlayerID": players["index"].get_level_values("PlayerID").tolist(),
+        }
+    )
+    stats = np.column_stack(
+        [counters, np.around(seconds * PACKED_SECONDS_SCALE)]
+    ).astype("<i2")
+
+    return len(header).to_bytes(4, "little") + header + stats.tobytes()
+
+
+def unpack_box_score(box_score, roster_df):
+    """(team_box_score, full_box_score) JSON for a pack_box_score blob.
+
+    roster_df is indexed by Team and PlayerID with Name and Position columns, and
+    fills those in for each player slot.
+
+    """
+    header_length = int.from_bytes(box_score[:4], "little")
+    header = orjson.loads(box_score[4 : 4 + header_length])
+    stats = np.frombuffer(box_score[4 + header_length :], dtype="<i2").reshape(
+        len(header["PlayerID"]), len(PACKED_BOX_SCORE_COLUMNS)
+    )
+    teams = np.array(header["teams"], dtype=object)[header["team_index"]]
+    roster_df = roster_df.reindex(
+        pd.MultiIndex.from_arrays([teams, header["PlayerID"]])
+    )
+
+    return box_score_documents(
+        teams,
+        header["PlayerID"],
+        roster_df.Name.to_numpy(dtype=object, na_value=None),
+        roster_df.Position.to_numpy(dtype=object, na_value=None),
+        stats[None, :, : len(BOX_SCORE_COLUMNS)],
+        stats[None, :, -1] / PACKED_SECONDS_SCALE,
+    )[0]
+
+
+def simulation_run_rows(results):
+    """SimulationRun documents as cbb_simulation_runs rows, lookup columns filled in.
+
+    The lookup columns are in canonical order, lower team key as home_key, and
+    home_margin is from that team's side. game_summary is left as simulated.
+
+    """
+    rows = []
+    for result in results:
+        game_summary = result["game_summary"]
+        away_key, home_key, sign = canonical_keys(
+            game_summary["away_key"], game_summary["home_key"]
+        )
+        rows.append(
+            dict(
+                result,
+                season=game_summary["season"],
+                away_key=away_key,
+                home_key=home_key,
+                home_margin=sign * game_summary["home_margin"],
+            )
+        )
+    return rows
+
+
+def simulation_run_document(session, simulation_run):
+    """A SimulationRunORM row as a SimulationRun document, unpacking its box score."""
+    team_box_score = simulation_run.team_box_score
+    full_box_score = simulation_run.full_box_score
+    if simulation_run.box_score is not None:
+        game_summary = simulation_run.game_summary
+        sql = select(
+            PlayerSeasonORM.Team,
+            PlayerSeasonORM.PlayerID,
+            PlayerSeasonORM.Name,
+            PlayerSeasonORM.Position,
+        ).where(
+            PlayerSeasonORM.Season == game_summary["season"],
+            PlayerSeasonORM.Team.in_(
+                [game_summary["away_key"], game_summary["home_key"]]
+            ),
+        )
+        roster_df = pd.DataFrame(
+            session.execute(sql).all(),
+            columns=["Team", "PlayerID", "Name", "Position"],
+        ).set_index(["Team", "PlayerID"])
+        team_box_score, full_box_score = unpack_box_score(
+            simulation_run.box_score, roster_df
+        )
+
+    return {
+        "id": simulation_run.id,
+        "game_summary": simulation_run.game_summary,
+        "team_box_score": team_box_score,
+        "full_box_score": full_box_score,
+        "seed": simulation_run.seed,
+    }
+
+
+def margin_distribution(players, season, accumulator):
+    """Summarize the home margin histogram into a SimulationDist document.
+
+    To lighten the load on the DB, we preserve the simulation distribution. This
+    is a way to avoid pulling tons of data for each bracket request.
+
+    """
+    margins, counts = accumulator.histogram()
+    user_breakpoints = {
+        q: int(margin)
+        for q, margin in zip(KEY_QUANTILES, accumulator.quantile(KEY_QUANTILES))
+    }
+
+    def win_chance(low, high):
+        in_range = (margins >= user_breakpoints[low]) & (
+            margins <= user_breakpoints[high]
+        )
+        return counts[in_range & (margins > 0)].sum() / counts[in_range].sum()
+
+    def win_chance_se(low, high):
+        return win_chance_error(
+            accumulator, user_breakpoints[low], user_breakpoints[high]
+        )
+
+    return {
+        "away_key": players["team_keys"][0],
+        "home_key": players["team_keys"][1],
+        "season": season.value,
+        "home_win_chance_max": counts[margins > 0].sum() / counts.sum(),
+        "max_margin_top": user_breakpoints[1.00],
+        "max_margin_bottom": user_breakpoints[0.00],
+        "home_win_chance_medium": win_chance(0.10, 0.90),
+        "medium_margin_top": user_breakpoints[0.90],
+        "medium_margin_bottom": user_breakpoints[0.10],
+        "home_win_chance_mild": win_chance(0.25, 0.75),
+        "mild_margin_top": user_breakpoints[0.75],
+        "mild_margin_bottom": user_breakpoints[0.25],
+        "home_win_chance_median": win_chance(0.40, 0.60),
+        "median_margin_top": user_breakpoints[0.60],
+        "median_margin_bottom": user_breakpoints[0.40],
+        "median_margin": user_breakpoints[0.50],
+        "home_win_chance_max_se": win_chance_se(0.00, 1.00),
+        "home_win_chance_medium_se": win_chance_se(0.10, 0.90),
+        "home_win_chance_mild_se": win_chance_se(0.25, 0.75),
+        "home_win_chance_median_se": win_chance_se(0.40, 0.60),
+        "sample_size": int(counts.sum()),
+    }
+
+
+def win_chance_error(accumulator, low, high):
+    """Standard error of the home win chance among games with low <= margin <= high.
+
+    The win chance is a ratio of two sums (wins in range over games in range),
+    so this is the delta method's ratio estimator. Antithetic games are only
+    independent pair by pair, so the sums are taken over pairs when there are
+    any, which is what picks up the pairs' negative correlation.
+
+    """
+    if accumulator.pair_counts:
+        pairs, counts = accumulator.pair_histogram()
+    else:
+        margins, counts = accumulator.histogram()
+        pairs = margins[:, None]
+
+    in_range = (pairs >= low) & (pairs <= high)
+    games = in_range.sum(axis=1)
+    wins = (in_range & (pairs > 0)).sum(axis=1)
+
+    total_games = (counts * games).sum()
+    chance = (counts * wins).sum() / total_games
+    return float(np.sqrt((counts * (wins - chance * games) ** 2).sum()) / total_games)
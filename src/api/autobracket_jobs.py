@@ -0,0 +1,274 @@
+"""Local job queue for season-wide autobracket simulations.
+
+Jobs are rows in the cbb_simulation_jobs table, so their progress survives an app
+restart. Each job is split into batches of matchups that run in the job share of
+the simulation process pool, and every batch is saved and counted as soon as it
+comes back.
+Failed batches are retried, and unfinished jobs pick up where they left off
+when the app starts again.
+
+"""
+# import native Python packages
+import asyncio
+import os
+from itertools import combinations
+from typing import Optional
+
+# import third party packages
+from fastapi import APIRouter, HTTPException, Depends, Path, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.future import Engine
+from sqlalchemy.orm import Session
+
+# import custom local stuff
+from src.api.apikey import get_api_key
+from src.api.autobracket_brackets import save_distributions
+from src.api.autobracket_engine import (
+    SeededRNG,
+    get_simulation_pool,
+    load_matchups,
+    simulation_pool,
+    simulation_pool_shutdown,
+)
+from src.api.autobracket_tables import march_madness
+from src.db.alchemy import engine_object, get_alchemy
+from src.db.models import (
+    FantasyDataSeason,
+    SimulationJob,
+    SimulationJobORM,
+    SimulationJobStatus,
+    VarianceReduction,
+)
+
+
+jobs_api = APIRouter(
+    prefix="/autobracket/jobs",
+    tags=["autobracket"],
+)
+
+
+def tournament_matchups(season):
+    """Every pair of teams in the season's tournament field, as (away, home) keys."""
+    bracket = march_madness.tournament(season).bracket
+
+    # build list of tournament teams. TBD is a placeholder not a team
+    away_keys = list(dict.fromkeys(game.away_key for game in bracket))
+    home_keys = list(dict.fromkeys(game.home_key for game in bracket))
+    away_keys.remove("TBD")
+    home_keys.remove("TBD")
+    tournament_teams = away_keys + home_keys
+
+    return list(combinations(tournament_teams, 2))
+
+
+class SimulationJobQueue:
+    """Runs simulation jobs in the background of this app worker.
+
+    Batches go through the pool's simulate_batch, so all jobs together only
+    use the pool's job_processes. A batch that raises is retried up to
+    max_attempts times before the job is marked as failed.
+
+    """
+
+    batch_size: int = int(os.getenv("SIMULATION_JOB_BATCH_SIZE", 64))
+    max_attempts: int = int(os.getenv("SIMULATION_JOB_MAX_ATTEMPTS", 3))
+
+    def __init__(self, pool=simulation_pool):
+        self.pool = pool
+        self.tasks = {}
+
+    def submit(
+        self,
+        engine,
+        season,
+        sample_size,
+        seed=None,
+        variance_reduction=VarianceReduction.NONE,
+        tolerance=None,
+    ):
+        """Save a new job for every matchup in the season's tournament.
+
+        With a tolerance, sample_size is each matchup's budget instead of its
+        exact number of games (see simulate_until).
+
+        """
+        with Session(engine) as session:
+            job = SimulationJobORM(
+                season=season.value,
+                sample_size=sample_size,
+                seed=SeededRNG(seed).seed,
+                variance_reduction=variance_reduction,
+                tolerance=tolerance,
+                batch_size=self.batch_size,
+                status=SimulationJobStatus.QUEUED,
+                total_matchups=len(tournament_matchups(season)),
+                completed_matchups=0,
+                completed_batches=[],
+                retries=0,
+            )
+            session.add(job)
+            session.commit()
+            return SimulationJob.from_orm(job)
+
+    def start(self, engine, job_id):
+        """Run a job in the background. Jobs that are already running are left be."""
+        if job_id in self.tasks and not self.tasks[job_id].done():
+            return self.tasks[job_id]
+        self.tasks[job_id] = asyncio.ensure_future(self.run(engine, job_id))
+        return self.tasks[job_id]
+
+    async def resume(self, engine):
+        """Restart every job that was queued or running when the app went down."""
+        with Session(engine) as session:
+            job_ids = (
+                session.execute(
+                    select(SimulationJobORM.id).where(
+                        SimulationJobORM.status.in_(
+                            [SimulationJobStatus.QUEUED, SimulationJobStatus.RUNNING]
+                        )
+                    )
+                )
+                .scalars()
+                .all()
+            )
+        for job_id in job_ids:
+            self.start(engine, job_id)
+        return job_ids
+
+    async def run(self, engine, job_id):
+        """Simulate every batch of a job that hasn't been saved yet."""
+        with Session(engine) as session:
+            job_row = session.get(SimulationJobORM, job_id)
+            job_row.status = SimulationJobStatus.RUNNING
+            session.commit()
+            completed_batches = set(job_row.completed_batches)
+            job = SimulationJob.from_orm(job_row)
+
+        # batches and their seeds only depend on the job row, so a resumed job
+        # skips the saved batches and reruns the rest exactly as they'd have run
+        matchup_keys = tournament_matchups(job.season)
+        batches = [
+            matchup_keys[start : start + job.batch_size]
+            for start in range(0, len(matchup_keys), job.batch_size)
+        ]
+        batch_seeds = (
+            SeededRNG(job.seed)
+            .generator("simulation")
+            .integers(2 ** 63, size=len(batches))
+        )
+
+        async def run_batch(index):
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    # rosters load in a thread, so the event loop keeps going
+                    matchups = await run_in_threadpool(
+                        load_matchups, engine, job.season, batches[index]
+                    )
+                    distributions = await self.pool.simulate_batch(
+                        matchups,
+                        job.season,
+                        job.sample_size,
+                        seed=int(batch_seeds[index]),
+                        variance_reduction=job.variance_reduction,
+                        tolerance=job.tolerance,
+                    )
+                    break
+                except Exception as e:
+                    self.record_retry(engine, job_id, f"Batch {index}: {e!r}")
+                    if attempt == self.max_attempts:
+                        raise
+
+            # save the batch and count it as done in the same transaction
+            with Session(engine) as session:
+                save_distributions(session, distributions)
+                job_row = session.get(SimulationJobORM, job_id)
+                job_row.completed_batches = job_row.completed_batches + [index]
+                job_row.completed_matchups += len(batches[index])
+                session.commit()
+
+        outcomes = await asyncio.gather(
+            *(
+                run_batch(index)
+                for index in range(len(batches))
+                if index not in completed_batches
+            ),
+            return_exceptions=True,
+        )
+
+        with Session(engine) as session:
+            job_row = session.get(SimulationJobORM, job_id)
+            if any(isinstance(outcome, Exception) for outcome in outcomes):
+                job_row.status = SimulationJobStatus.FAILED
+            else:
+                job_row.status = SimulationJobStatus.COMPLETE
+                job_row.error = None
+            session.commit()
+            return SimulationJob.from_orm(job_row)
+
+    def record_retry(self, engine, job_id, error):
+        with Session(engine) as session:
+            job_row = session.get(SimulationJobORM, job_id)
+            job_row.retries += 1
+            job_row.error = error
+            session.commit()
+
+
+simulation_jobs = SimulationJobQueue()
+
+
+async def get_simulation_jobs():
+    return simulation_jobs
+
+
+async def simulation_jobs_startup():
+    """Pick unfinished jobs back up once the DB engine is ready."""
+    await get_simulation_pool()
+    await simulation_jobs.resume(engine_object.engine)
+
+
+jobs_api.add_event_handler("startup", simulation_jobs_startup)
+jobs_api.add_event_handler("shutdown", simulation_pool_shutdown)
+
+
+@jobs_api.post(
+    "/{season}/{sample_size}",
+    response_model=SimulationJob,
+    status_code=202,
+    dependencies=[Depends(get_api_key), Depends(get_simulation_pool)],
+)
+async def submit_simulation_job(
+    season: FantasyDataSeason,
+    sample_size: int = Path(..., gt=0, le=100000),
+    seed: Optional[int] = Query(None, ge=0, lt=2 ** 63),
+    variance_reduction: VarianceReduction = Query(VarianceReduction.NONE),
+    tolerance: Optional[float] = Query(None, gt=0, lt=0.5),
+    engine: Engine = Depends(get_alchemy),
+    jobs: SimulationJobQueue = Depends(get_simulation_jobs),
+):
+    """Queue a simulation of every matchup in the season's tournament.
+
+    The job runs in the background on this worker's process pool, in the share
+    of it set aside for jobs (see SimulationPool). Poll its status
+    with the job id that comes back. Antithetic and common random number modes
+    reach the same standard errors with fewer games (see shared_streams). With a
+    tolerance, each matchup stops once its home_win_chance_max is known to
+    within tolerance, so lopsided matchups only use a fraction of sample_size.
+
+    """
+    job = jobs.submit(
+        engine, season, sample_size, seed, variance_reduction, tolerance
+    )
+    jobs.start(engine, job.id)
+
+    return job
+
+
+@jobs_api.get("/{job_id}", response_model=SimulationJob)
+async def get_simulation_job(job_id: int, engine: Engine = Depends(get_alchemy)):
+    with Session(engine) as session:
+        job = session.get(SimulationJobORM, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="No data found!")
+
+        return SimulationJob.from_orm(job)
@@ -0,0 +1,49 @@
+"""JSON responses for autobracket, straight from NumPy.
+
+Endpoints return a NumpyJSONResponse instead of their content, so FastAPI skips
+jsonable_encoder and the content goes to bytes in a single orjson call. Arrays and
+NumPy scalars are serialized natively. DataFrames go through frame_records, which
+converts each column once instead of round tripping through a pandas JSON string.
+
+"""
+# import third party packages
+from fastapi.responses import ORJSONResponse
+import numpy as np
+import orjson
+import pandas as pd
+
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def json_default(value):
+    """Anything orjson won't take natively: object arrays, odd scalars and pd.NA."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA:
+        return None
+    raise TypeError(f"Can't serialize {type(value).__name__} to JSON!")
+
+
+def dumps(content):
+    return orjson.dumps(content, default=json_default, option=JSON_OPTIONS)
+
+
+class NumpyJSONResponse(ORJSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def frame_records(frame):
+    """A DataFrame's rows as dicts of plain Python values, like orient="records".
+
+    Missing values of any dtype come back as None, and the index is dropped.
+
+    """
+    columns = [
+        frame.iloc[:, column].to_numpy(dtype=object, na_value=None).tolist()
+        for column in range(frame.shape[1])
+    ]
+    return [dict(zip(frame.columns, row)) for row in zip(*columns)]
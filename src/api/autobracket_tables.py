@@ -0,0 +1,195 @@
+"""Startup-loaded tables from src/db/march_madness.
+
+Every CSV in the folder is parsed once, when the app starts, into tuples of typed
+rows keyed by season: the bracket template, the real results, and the Kenpom
+ratings, plus the Kenpom to FantasyData school name mapping that every season
+shares. The bracket template also comes pre-built as a BracketTree with its
+arrays locked. Request handlers only ever read from march_madness, so nothing
+on the hot path touches the filesystem or the CSV parser.
+
+"""
+# import native Python packages
+from dataclasses import dataclass
+import pathlib
+import re
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# import third party packages
+from fastapi import HTTPException
+import numpy as np
+import pandas as pd
+
+# import custom local stuff
+from src.api.autobracket_brackets import BracketTree
+
+
+MARCH_MADNESS_PATH = pathlib.Path("src/db/march_madness")
+
+
+class BracketGame(NamedTuple):
+    game_id: int
+    region: str
+    away_seed: str
+    away_key: str
+    away_school: str
+    home_seed: str
+    home_key: str
+    home_school: str
+    advance_to: int
+
+
+class BracketResult(NamedTuple):
+    game_id: int
+    region: str
+    away_seed: int
+    away_key: str
+    away_school: str
+    home_seed: int
+    home_key: str
+    home_school: str
+    advance_to: int
+    real_winner: str
+
+
+class KenpomTeam(NamedTuple):
+    Season: int
+    Rk: int
+    Team: str
+    Conf: str
+    W: int
+    L: int
+    AdjEM: float
+    AdjO: float
+    AdjD: float
+    AdjT: float
+    Luck: float
+    OppAdjEM: float
+    OppO: float
+    OppD: float
+    NCAdjEM: float
+
+
+class SchoolName(NamedTuple):
+    fd_team_id: int
+    fd_key: str
+    fd_school: str
+    fd_name: str
+    kenpom_team: str
+
+
+@dataclass(frozen=True)
+class SeasonTables:
+    """Everything in src/db/march_madness for one season.
+
+    A season without a tournament (or without results yet) has no bracket,
+    tree or results.
+
+    """
+
+    season: str
+    kenpom: Tuple[KenpomTeam, ...] = ()
+    bracket: Tuple[BracketGame, ...] = ()
+    tree: Optional[BracketTree] = None
+    results: Tuple[BracketResult, ...] = ()
+    # real winners as BracketTree team numbers, in tree game order
+    result_codes: Optional[np.ndarray] = None
+
+
+def read_rows(csv_path, row_type):
+    """Parse a CSV into a tuple of row_type, with each field cast to its type."""
+    csv_df = pd.read_csv(csv_path, encoding="utf-8-sig")
+    return tuple(
+        row_type(
+            *(
+                field_type(value)
+                for field_type, value in zip(
+                    row_type.__annotations__.values(), row[list(row_type._fields)]
+                )
+            )
+        )
+        for _, row in csv_df.iterrows()
+    )
+
+
+def locked(tree):
+    """Make every array on a BracketTree read-only."""
+    for value in vars(tree).values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+    for level in tree.levels:
+        level.setflags(write=False)
+    return tree
+
+
+class MarchMadnessRegistry:
+    """Every season's SeasonTables, loaded from disk once."""
+
+    school_names: Tuple[SchoolName, ...] = ()
+
+    def __init__(self):
+        self.seasons: Dict[str, SeasonTables] = {}
+
+    def load(self, path=MARCH_MADNESS_PATH):
+        path = pathlib.Path(path)
+        tables = {}
+        for csv_path in sorted(path.glob("*_[0-9][0-9][0-9][0-9].csv")):
+            table, season = re.fullmatch(r"(.+)_(\d{4})", csv_path.stem).groups()
+            tables.setdefault(season, {})[table] = csv_path
+
+        seasons = {}
+        for season, paths in tables.items():
+            season_tables = {"season": season}
+            if "kenpom" in paths:
+                season_tables["kenpom"] = read_rows(paths["kenpom"], KenpomTeam)
+            if "matchup_table" in paths:
+                bracket = read_rows(paths["matchup_table"], BracketGame)
+                tree = locked(
+                    BracketTree(pd.DataFrame(bracket).set_index("game_id"))
+                )
+                season_tables.update(bracket=bracket, tree=tree)
+                if "matchup_results" in paths:
+                    results = read_rows(paths["matchup_results"], BracketResult)
+                    winners = {result.game_id: result.real_winner for result in results}
+                    result_codes = tree.team_codes(
+                        [winners[game_id] for game_id in tree.game_ids]
+                    )
+                    result_codes.setflags(write=False)
+                    season_tables.update(results=results, result_codes=result_codes)
+            seasons[season] = SeasonTables(**season_tables)
+
+        self.seasons = seasons
+        self.school_names = read_rows(path / "school_names.csv", SchoolName)
+
+    def season(self, season):
+        """The SeasonTables for a FantasyDataSeason, 404 if there aren't any."""
+        if not self.seasons:
+            self.load()
+        try:
+            return self.seasons[season.value]
+        except KeyError:
+            raise HTTPException(status_code=404, detail="No data found!")
+
+    def tournament(self, season):
+        """The SeasonTables for a season that has a bracket, 404 if it doesn't."""
+        tables = self.season(season)
+        if tables.tree is None:
+            raise HTTPException(status_code=404, detail="No data found!")
+        return tables
+
+    def tournament_results(self, season):
+        """The SeasonTables for a season with real results, 404 until there are some."""
+        tables = self.tournament(season)
+        if tables.result_codes is None:
+            raise HTTPException(status_code=404, detail="No data found!")
+        return tables
+
+
+march_madness = MarchMadnessRegistry()
+
+
+async def get_march_madness():
+    return march_madness
+
+
+async def march_madness_startup():
+    march_madness.load()
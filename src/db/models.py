@@ -4,6 +4,7 @@ from datetime import date
 
 from sqlalchemy import types
 from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Date, Float, JSON
+from sqlalchemy import Index, LargeBinary
 from sqlalchemy.orm import declarative_base
 from pydantic import BaseModel, Field, validator
 
@@ -490,6 +491,17 @@ class PlayerSeason(BaseModel):
 
 class SimulationDistORM(Base):
     __tablename__ = "cbb_simulation_distributions"
+    # one row per unordered pair of teams: home_key is always the lower team key,
+    # and every stat is from its side (see autobracket_brackets)
+    __table_args__ = (
+        Index(
+            "ix_cbb_simulation_distributions_matchup",
+            "season",
+            "home_key",
+            "away_key",
+            unique=True,
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     away_key = Column(String)
@@ -508,6 +520,13 @@ class SimulationDistORM(Base):
     median_margin_top = Column(Integer)
     median_margin_bottom = Column(Integer)
     median_margin = Column(Integer)
+    # standard errors of the win chances, from however the games were sampled
+    home_win_chance_max_se = Column(Float)
+    home_win_chance_medium_se = Column(Float)
+    home_win_chance_mild_se = Column(Float)
+    home_win_chance_median_se = Column(Float)
+    # games the distribution was summarized from, fewer than asked if it stopped early
+    sample_size = Column(Integer)
 
 
 class SimulationDist(BaseModel):
@@ -527,6 +546,11 @@ class SimulationDist(BaseModel):
     median_margin_top: int
     median_margin_bottom: int
     median_margin: int
+    home_win_chance_max_se: Optional[float]
+    home_win_chance_medium_se: Optional[float]
+    home_win_chance_mild_se: Optional[float]
+    home_win_chance_median_se: Optional[float]
+    sample_size: Optional[int]
 
 
 class FantasyDataSeason(str, Enum):
@@ -543,17 +567,38 @@ class BracketFlavor(str, Enum):
 
 class SimulationRunORM(Base):
     __tablename__ = "cbb_simulation_runs"
+    # box scores are looked up by matchup and a range of home margins
+    __table_args__ = (
+        Index(
+            "ix_cbb_simulation_runs_matchup",
+            "season",
+            "away_key",
+            "home_key",
+            "home_margin",
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
+    # copied out of game_summary so lookups don't have to scan the JSON, in
+    # canonical order (lower team key as home_key, margin from its side)
+    season = Column(String)
+    away_key = Column(String)
+    home_key = Column(String)
+    home_margin = Column(Integer)
     game_summary = Column(JSON)
     team_box_score = Column(JSON)
     full_box_score = Column(JSON)
+    # packed alternative to the two JSON box scores, see autobracket_engine
+    box_score = Column(LargeBinary)
+    seed = Column(BigInteger)
 
 
 class SimulationRun(BaseModel):
     game_summary: Dict
-    team_box_score: Dict
-    full_box_score: Dict
+    team_box_score: Optional[Dict]
+    full_box_score: Optional[Dict]
+    box_score: Optional[bytes]
+    seed: Optional[int]
 
 
 class SimulatedBracketORM(Base):
@@ -562,8 +607,61 @@ class SimulatedBracketORM(Base):
     id = Column(Integer, primary_key=True)
     bracket = Column(JSON)
     flavor = Column(types.Enum(BracketFlavor))
+    seed = Column(BigInteger)
 
 
 class SimulatedBracket(BaseModel):
     flavor: BracketFlavor
     bracket: Dict
+    seed: Optional[int]
+
+
+class SimulationJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETE = "complete"
+    FAILED = "failed"
+
+
+class VarianceReduction(str, Enum):
+    NONE = "none"
+    ANTITHETIC = "antithetic"
+    COMMON = "common"
+    ANTITHETIC_COMMON = "antithetic_common"
+
+
+class SimulationJobORM(Base):
+    __tablename__ = "cbb_simulation_jobs"
+
+    id = Column(Integer, primary_key=True)
+    season = Column(String)
+    sample_size = Column(Integer)
+    seed = Column(BigInteger)
+    variance_reduction = Column(types.Enum(VarianceReduction))
+    tolerance = Column(Float)
+    batch_size = Column(Integer)
+    status = Column(types.Enum(SimulationJobStatus))
+    total_matchups = Column(Integer)
+    completed_matchups = Column(Integer)
+    completed_batches = Column(JSON)
+    retries = Column(Integer)
+    error = Column(String)
+
+
+class SimulationJob(BaseModel):
+    id: int
+    season: FantasyDataSeason
+    sample_size: int
+    seed: int
+    variance_reduction: VarianceReduction
+    tolerance: Optional[float]
+    batch_size: int
+    status: SimulationJobStatus
+    total_matchups: int
+    completed_matchups: int
+    retries: int
+    error: Optional[str]
+
+    # necessary for parsing a SQLAlchemy ORM result
+    class Config:
+        orm_mode = True
@@ -13,6 +13,7 @@ from dotenv import load_dotenv
 from src.api.users import users_api
 from src.api.index import index_api
 # from src.api.autobracket import ab_api
+from src.api.autobracket_jobs import jobs_api
 from src.api.haveyouseenx import hysx_api
 # from src.api.mildredleague import ml_api
 from src.api.security import security_api, validate_jwt
@@ -92,6 +93,7 @@ def create_fastapi_app():
     api_app.include_router(index_api)
     api_app.include_router(hysx_api)
     # api_app.include_router(ab_api)
+    api_app.include_router(jobs_api)
     # api_app.include_router(ml_api)
     api_app.include_router(security_api)
 
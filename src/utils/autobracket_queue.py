@@ -1,98 +1,66 @@
 """These files are meant to run locally when necessary, not on the web."""
+import asyncio
 import os
-from itertools import combinations
-import pandas as pd
-import pathlib
-from google.cloud import tasks_v2
-import requests
+from time import perf_counter
+from dotenv import load_dotenv
 
+from src.api.autobracket_engine import (
+    get_simulation_pool,
+    simulation_pool_shutdown,
+)
+from src.api.autobracket_jobs import simulation_jobs
+from src.db.models import FantasyDataSeason, VarianceReduction
+from src.db.startup import alchemy_startup
 
-GCP_LOCATION = os.getenv("GCP_LOCATION")
-GCP_MM_QUEUE = os.getenv("GCP_MM_QUEUE")
-GCP_PROJECT = os.getenv("GCP_PROJECT")
-GCP_QUEUE_SA_EMAIL = os.getenv("GCP_QUEUE_SA_EMAIL")
-OKTA_ENCODED_ID_SECRET = os.getenv("OKTA_ENCODED_ID_SECRET")
-API_KEY_NAME = os.getenv("API_KEY_NAME")
-API_KEY = os.getenv("API_KEY")
 
+async def simulate_all_matchups():
+    """Used to precompute all possible matchups for the March Madness simulator.
 
-def simulate_all_matchups():
-    """Used to queue up all possible matchups for the March Madness simulator."""
-    year = input("Year: ")
-
-    # need all team combos for simulation
-    all_matchups_df = pd.read_csv(
-        pathlib.Path(f"src/db/matchup_table_{year}.csv"),
-    )
-
-    # build list of tournament teams
-    away_keys = list(all_matchups_df.away_key.unique())
-    home_keys = list(all_matchups_df.home_key.unique())
-    # TBD is a placeholder not a team
-    away_keys.remove("TBD")
-    home_keys.remove("TBD")
-    tournament_teams = away_keys + home_keys
-    tournament_matchups = list(combinations(tournament_teams, 2))
-    # generate list of request URLs to queue up
-    tournament_game_urls = [
-        f"https://api.tarpey.dev/autobracket/sim/{year}/{matchup[0]}/{matchup[1]}/1000"
-        for matchup in tournament_matchups
-    ]
-
-    # Create a cloud tasks client
-    client = tasks_v2.CloudTasksClient()
-
-    # google cloud task queue info
-    project = GCP_PROJECT
-    queue = GCP_MM_QUEUE
-    location = GCP_LOCATION
-    service_account_email = GCP_QUEUE_SA_EMAIL
-
-    # Construct the fully qualified queue name.
-    parent = client.queue_path(project, location, queue)
+    Runs the same season-wide job as the /autobracket/jobs endpoint, on this
+    machine's cores. If it gets interrupted, running it again for the same job
+    picks up from the last saved batch.
 
-    # initial request for JWT if necessary
-    # r = requests.post(
-    #     f"https://api.tarpey.dev/security/token",
-    #     headers={
-    #         "accept": "application/json",
-    #         "authorization": "Basic " + OKTA_ENCODED_ID_SECRET,
-    #     },
-    #     data={"grant_type": "client_credentials", "scope": "all_data"},
-    # )
+    """
+    load_dotenv()
+    # setting this env will return a connection engine from the startup function
+    os.environ["INIT"] = "yes"
+    engine = await alchemy_startup()
 
-    # now we can construct task queue headers/body
-    headers = {
-        "accept": "application/json",
-        API_KEY_NAME: API_KEY,
-    }
-    payload = None
-
-    # Construct the requests.
-    response_list = []
-    for url in tournament_game_urls:
-        new_task = {
-            "http_request": {
-                "http_method": tasks_v2.HttpMethod.POST,
-                "url": url,
-                "oidc_token": {"service_account_email": service_account_email},
-            }
-        }
-        if headers is not None:
-            new_task["http_request"]["headers"] = headers
-        if payload is not None:
-            # The API expects a payload of type bytes.
-            converted_payload = payload.encode()
-
-            # Add the payload to the request.
-            new_task["http_request"]["body"] = converted_payload
-
-        response = client.create_task(request={"parent": parent, "task": new_task})
-        print("Created task {}".format(response.name))
-        response_list.append(response)
-
-    return response_list
+    year = input("Year: ")
+    sample_size = int(input("Games per matchup (1000): ") or 1000)
+    variance_reduction = VarianceReduction(
+        input("Variance reduction (none, antithetic, common, antithetic_common): ")
+        or "none"
+    )
+    tolerance = input("Stop each matchup within this win chance (blank to run all): ")
+    tolerance = float(tolerance) if tolerance else None
+    job_id = input("Job ID to resume (blank for a new job): ")
+    if job_id:
+        job_id = int(job_id)
+    else:
+        job_id = simulation_jobs.submit(
+            engine,
+            FantasyDataSeason(year),
+            sample_size,
+            variance_reduction=variance_reduction,
+            tolerance=tolerance,
+        ).id
+
+    # nothing else is using this machine's pool, so the job gets all of it
+    pool = await get_simulation_pool()
+    pool.job_processes = pool.processes
+    start_time = perf_counter()
+    try:
+        job = await simulation_jobs.run(engine, job_id)
+    finally:
+        await simulation_pool_shutdown()
+
+    print(
+        f"Job {job.id} {job.status.value}: {job.completed_matchups} of "
+        + f"{job.total_matchups} matchups in {perf_counter() - start_time:.1f}s"
+    )
+    return job
 
 
 if __name__ == "__main__":
-    simulate_all_matchups()
+    asyncio.run(simulate_all_matchups())
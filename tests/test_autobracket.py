@@ -0,0 +1,1825 @@
+# import native Python packages
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, permutations, product
+import multiprocessing
+import os
+import pathlib
+from time import perf_counter
+
+# import third party packages
+from fastapi import HTTPException
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session
+
+# import custom local stuff
+# the API key header needs a name before the job router can be imported
+os.environ.setdefault("API_KEY_NAME", "access_token")
+from src.api import (
+    autobracket,
+    autobracket_brackets,
+    autobracket_engine,
+    autobracket_jobs,
+    autobracket_json,
+    autobracket_tables,
+)
+from src.db.models import (
+    Base,
+    BracketFlavor,
+    CBBTeamORM,
+    FantasyDataSeason,
+    PlayerSeasonORM,
+    SimulatedBracketORM,
+    SimulationDistORM,
+    SimulationJobORM,
+    SimulationJobStatus,
+    SimulationRunORM,
+    VarianceReduction,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_matchup_inputs(monkeypatch):
+    '''Every test loads teams from its own DB, not ones cached by another test.'''
+    matchup_inputs = autobracket_engine.MatchupInputCache()
+    monkeypatch.setattr(autobracket_engine, "matchup_inputs", matchup_inputs)
+    monkeypatch.setattr(autobracket, "matchup_inputs", matchup_inputs)
+
+
+def make_matchup_df(away_key="AWAY", home_key="HOME", roster_size=10, seed=7):
+    '''Build a fake PlayerSeason matchup frame with plausible season stats.'''
+    rng = np.random.default_rng(seed)
+    rows = []
+    for team_id, team in enumerate([away_key, home_key]):
+        for player in range(roster_size):
+            minutes = int(rng.integers(100, 900))
+            fga = int(minutes * rng.uniform(0.2, 0.45))
+            two_pa = int(fga * rng.uniform(0.4, 0.9))
+            three_pa = fga - two_pa
+            two_pm = int(two_pa * rng.uniform(0.4, 0.6))
+            three_pm = int(three_pa * rng.uniform(0.25, 0.4))
+            fta = int(minutes * rng.uniform(0.05, 0.2))
+            ftm = int(fta * rng.uniform(0.6, 0.85))
+            rows.append(
+                {
+                    "PlayerID": 1000 * (team_id + 1) + player,
+                    "Name": f"{team} Player {player}",
+                    "Team": team,
+                    "Position": "G",
+                    "Minutes": minutes,
+                    "FieldGoalsMade": two_pm + three_pm,
+                    "FieldGoalsAttempted": fga,
+                    "TwoPointersMade": two_pm,
+                    "TwoPointersAttempted": two_pa,
+                    "ThreePointersMade": three_pm,
+                    "ThreePointersAttempted": three_pa,
+                    "FreeThrowsMade": ftm,
+                    "FreeThrowsAttempted": fta,
+                    "OffensiveRebounds": int(minutes * rng.uniform(0.02, 0.08)),
+                    "DefensiveRebounds": int(minutes * rng.uniform(0.08, 0.2)),
+                    "Assists": int(minutes * rng.uniform(0.03, 0.15)),
+                    "Steals": int(minutes * rng.uniform(0.01, 0.05)),
+                    "BlockedShots": int(minutes * rng.uniform(0.0, 0.04)),
+                    "Turnovers": int(minutes * rng.uniform(0.03, 0.08)),
+                    "PersonalFouls": int(minutes * rng.uniform(0.04, 0.09)),
+                    "two_attempt_chance": two_pa / fga,
+                    "two_chance": two_pm / two_pa,
+                    "three_chance": three_pm / three_pa,
+                    "ft_chance": ftm / fta,
+                }
+            )
+    matchup_df = pd.DataFrame(rows)
+    matchup_df["designation"] = "home"
+    matchup_df.loc[matchup_df["Team"] == away_key, "designation"] = "away"
+    return matchup_df
+
+
+def single_batch(matchup_df=None):
+    players = autobracket_engine.player_arrays(
+        make_matchup_df() if matchup_df is None else matchup_df
+    )
+    return players, autobracket_engine.matchup_batch([players], [136.0], [0.02], [-0.01])
+
+
+def run_engine(engine, sample_size, seed, **kwargs):
+    return engine.run_simulation(
+        make_matchup_df(),
+        FantasyDataSeason.CURRENTSEASON,
+        sample_size,
+        136.0,
+        0.02,
+        -0.01,
+        seed=seed,
+        **kwargs,
+    )
+
+
+def test_engine_is_seeded():
+    '''The same seed should replay the exact same simulation.'''
+    assert run_engine(autobracket_engine, 200, 1) == run_engine(
+        autobracket_engine, 200, 1
+    )
+
+
+def test_unseeded_run_records_a_replayable_seed():
+    '''Runs without a seed should record the one they drew.'''
+    results, distribution = run_engine(autobracket_engine, 200, None)
+    seed = results[0]["seed"]
+
+    assert all(game["seed"] == seed for game in results)
+    assert 0 <= seed < 2 ** 63
+    assert run_engine(autobracket_engine, 200, seed) == (results, distribution)
+
+
+def test_rng_phases_are_independent_streams():
+    '''Each phase gets its own stream, and the same phase replays.'''
+    streams = autobracket_engine.SeededRNG(1)
+    bracket_draws = streams.generator("bracket").random(5)
+
+    assert (bracket_draws == streams.generator("bracket").random(5)).all()
+    assert (bracket_draws != streams.generator("box_scores").random(5)).all()
+
+
+def test_engine_matches_the_recorded_pandas_distribution():
+    '''The numpy engine plays the same kind of games as the original engine.
+
+    tests/fixtures/baseline_simulation.json was recorded from the original
+    pandas run_simulation: 24 runs of 250 games, with ten-man rosters that
+    shoot, rebound, assist, steal, block, turn it over and foul. Games in one
+    of its runs shared their lineups, so the recorded standard errors come from
+    the spread of the run means. Its event_sampler weighted every game's pick
+    by the first game's players, so it was recorded with each game using its
+    own. Every mean has to land within four standard errors, and every spread
+    within 10%.
+
+    '''
+    fixture = pathlib.Path(__file__).parent / "fixtures" / "baseline_simulation.json"
+    golden = orjson.loads(fixture.read_bytes())
+    players = autobracket_engine.player_arrays(pd.DataFrame(golden["players"]))
+    batch = autobracket_engine.matchup_batch(
+        [players],
+        [golden["kenpom_tempo"]],
+        [golden["home_strength"]],
+        [golden["away_strength"]],
+    )
+    counters, _, total_possessions, scores = autobracket_engine.simulate_games(
+        batch, np.zeros(20000, dtype=np.intp), np.random.default_rng(1)
+    )
+    margins = scores[:, 1] - scores[:, 0]
+
+    observed = {
+        "home_margin": margins,
+        "home_win_chance": margins > 0,
+        "total_possessions": total_possessions,
+    }
+    recorded = {name: golden[name] for name in observed}
+    for team, side in enumerate(["away", "home"]):
+        totals = counters[:, players["team_index"] == team].sum(axis=1)
+        columns = autobracket_engine.BOX_SCORE_COLUMNS + ["sim_points"]
+        for column, values in zip(columns, [*totals.T, scores[:, team]]):
+            observed[f"{side} {column}"] = values
+            recorded[f"{side} {column}"] = golden["teams"][side][column]
+
+    for name, values in observed.items():
+        values = values.astype(float)
+        mean, std = values.mean(), values.std(ddof=1)
+        se = np.hypot(recorded[name]["se"], std / np.sqrt(len(values)))
+        assert abs(mean - recorded[name]["mean"]) < 4 * se, name
+        assert std == pytest.approx(recorded[name]["std"], rel=0.1), name
+
+
+def test_packed_box_scores_unpack_to_the_json_box_scores():
+    '''Packed box scores decode back to the same JSON, with seconds to a tenth.'''
+    json_results, distribution = run_engine(autobracket_engine, 500, 3)
+    packed_results, packed_distribution = run_engine(
+        autobracket_engine, 500, 3, packed_box_scores=True
+    )
+    assert packed_distribution == distribution
+
+    for json_game, packed_game in zip(json_results, packed_results):
+        assert packed_game.keys() == {"game_summary", "box_score", "seed"}
+        assert packed_game["game_summary"] == json_game["game_summary"]
+        assert len(packed_game["box_score"]) * 10 < len(
+            orjson.dumps([json_game["team_box_score"], json_game["full_box_score"]])
+        )
+
+        # names and positions come from the player seasons
+        roster_df = make_matchup_df().set_index(["Team", "PlayerID"])
+        team_box_score, full_box_score = autobracket_engine.unpack_box_score(
+            packed_game["box_score"], roster_df
+        )
+        game = {"team_box_score": team_box_score, "full_box_score": full_box_score}
+        for box_score in ("team_box_score", "full_box_score"):
+            assert game[box_score].keys() == json_game[box_score].keys()
+            for key, row in game[box_score].items():
+                for stat, value in row.items():
+                    expected = json_game[box_score][key][stat]
+                    if stat in ("sim_seconds", "sim_minutes"):
+                        assert value == pytest.approx(expected, abs=0.5)
+                    else:
+                        assert value == expected
+
+
+def test_numpy_json_skips_the_pandas_round_trip():
+    '''Frames and arrays serialize to the same JSON pandas used to produce.'''
+    frame = pd.DataFrame(
+        {
+            "game_id": [1, 2, 3],
+            "away_key": ["AAA", None, "CCC"],
+            "away_seed": [16, None, 11],
+            "home_win_chance": [0.25, np.nan, 0.75],
+            "sim_winner": ["AAA", "BBB", "CCC"],
+        }
+    ).convert_dtypes()
+    frame["sim_reroll"] = np.array([0.125, 0.5, 0.875])
+
+    records = autobracket_json.frame_records(frame)
+    assert records == orjson.loads(frame.to_json(orient="records"))
+    assert all(type(record["game_id"]) is int for record in records)
+
+    response = autobracket_json.NumpyJSONResponse(
+        {
+            "game_ids": np.arange(3, dtype=np.int16),
+            "brackets": np.array([["AAA", "BBB"], ["CCC", "AAA"]], dtype=object),
+            "title_chance": np.float64(0.5),
+            "records": records,
+            "missing": pd.NA,
+        }
+    )
+    assert orjson.loads(response.body) == {
+        "game_ids": [0, 1, 2],
+        "brackets": [["AAA", "BBB"], ["CCC", "AAA"]],
+        "title_chance": 0.5,
+        "records": records,
+        "missing": None,
+    }
+
+
+def test_lineups_are_sampled_per_simulation():
+    '''Each simulation should get its own five players per team.'''
+    players, batch = single_batch()
+    rng = np.random.default_rng(1)
+    lineups = autobracket_engine.sample_lineups(rng, batch, np.zeros(500, dtype=int))
+
+    assert lineups.shape == (500, 2, 5)
+    # five different players per team, from the right team
+    assert all(len(set(five)) == 5 for five in lineups.reshape(-1, 5))
+    assert np.isin(lineups[:, 0], players["slots"][0]).all()
+    assert np.isin(lineups[:, 1], players["slots"][1]).all()
+    # and not everyone shares the same lineup
+    assert len({tuple(sorted(five)) for five in lineups[:, 0]}) > 1
+
+
+def sequential_inclusion_chances(weights, k):
+    '''Exact chance each item is among k picked one at a time by weight.'''
+    chances = np.zeros(len(weights))
+    for order in permutations(np.flatnonzero(weights), k):
+        remaining = 1.0
+        chance = 1.0
+        for item in order:
+            chance *= weights[item] / remaining
+            remaining -= weights[item]
+        chances[list(order)] += chance
+    return chances
+
+
+def test_weighted_sample_matches_sequential_draw():
+    '''Gumbel-top-k should include players exactly as often as sequential draws.'''
+    weights = np.array([0.3, 0.2, 0.15, 0.1, 0.1, 0.05, 0.05, 0.03, 0.02, 0.0])
+    rng = np.random.default_rng(1)
+    draws = 50000
+
+    with np.errstate(divide="ignore"):
+        picks = autobracket_engine.gumbel_top_k(rng, np.log(weights), draws, 5)
+    rates = np.bincount(picks.flatten(), minlength=10) / draws
+    chances = sequential_inclusion_chances(weights, 5)
+
+    assert chances.sum() == pytest.approx(5)
+    assert rates[-1] == 0
+    # within four standard errors of every exact inclusion chance
+    standard_errors = np.sqrt(chances * (1 - chances) / draws)
+    assert (np.abs(rates - chances) <= 4 * standard_errors).all()
+
+
+def test_pick_players_uses_each_games_weights():
+    '''Each game should pick one player with that game's own weights.'''
+    weights = np.tile(
+        np.array([[1.0, 0.0, 0.0, 0.0, 3.0], [0.0, 2.0, 2.0, 0.0, 0.0]]), (20000, 1)
+    )
+    rng = np.random.default_rng(1)
+    picks = autobracket_engine.pick_players(rng, weights)
+
+    assert picks.shape == (len(weights),)
+    # players with no weight in their own game never get picked
+    assert (weights[np.arange(len(weights)), picks] > 0).all()
+    for game in (0, 1):
+        rates = np.bincount(picks[game::2], minlength=5) / len(picks[game::2])
+        chances = weights[game] / weights[game].sum()
+        standard_errors = np.sqrt(chances * (1 - chances) / len(picks[game::2]))
+        assert (np.abs(rates - chances) <= 4 * standard_errors).all()
+
+
+def test_sharded_simulation_merges_like_a_single_run():
+    '''Shards on a process pool should merge exactly like shards run in order.'''
+    with ProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pooled = run_engine(autobracket_engine, 1000, 1, shards=4, executor=executor)
+    in_order = run_engine(autobracket_engine, 1000, 1, shards=4)
+    single = run_engine(autobracket_engine, 1000, 1)
+
+    assert pooled == in_order
+    # independent streams per shard, so the games themselves differ...
+    assert pooled != single
+    # ...but they summarize the same way
+    assert len(pooled[0]) == len(single[0])
+    assert (
+        abs(pooled[1]["home_win_chance_max"] - single[1]["home_win_chance_max"])
+        < 0.08
+    )
+
+
+def test_simulation_pool_runs_off_the_event_loop():
+    '''The loop keeps ticking during a simulation, and a full queue gets a 503.'''
+    pool = autobracket_engine.SimulationPool()
+    pool.max_running = 1
+    pool.max_queued = 0
+
+    async def scenario():
+        running = asyncio.ensure_future(
+            pool.simulate(
+                make_matchup_df(),
+                FantasyDataSeason.CURRENTSEASON,
+                2000,
+                136.0,
+                0.02,
+                -0.01,
+                seed=1,
+            )
+        )
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as turned_away:
+            await pool.simulate(
+                make_matchup_df(),
+                FantasyDataSeason.CURRENTSEASON,
+                10,
+                136.0,
+                0.02,
+                -0.01,
+            )
+        ticks = 0
+        while not running.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return turned_away.value, ticks, await running
+
+    turned_away, ticks, (results, distribution) = asyncio.run(scenario())
+
+    assert turned_away.status_code == 503
+    assert turned_away.headers["Retry-After"] == str(pool.retry_after)
+    assert ticks > 5
+    assert len(results) == 15
+    assert pool.in_flight == 0
+
+
+def test_full_game_simulation_endpoint_saves_through_the_pool():
+    '''/sim runs the matchup in the pool and saves its runs and distribution.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    pool = autobracket_engine.SimulationPool()
+
+    def simulate(seed):
+        return asyncio.run(
+            autobracket.full_game_simulation(
+                season,
+                "B",
+                "A",
+                400,
+                seed=seed,
+                variance_reduction=VarianceReduction.NONE,
+                tolerance=None,
+                engine=engine,
+                pool=pool,
+            )
+        )
+
+    summary = simulate(3)
+    assert summary["seed"] == 3
+    assert summary["simulations"] == 400
+    assert pool.in_flight == 0
+
+    with Session(engine) as session:
+        runs = session.execute(select(SimulationRunORM)).scalars().all()
+        (distribution,) = session.execute(select(SimulationDistORM)).scalars().all()
+    assert runs
+    assert all(run.seed == 3 for run in runs)
+    assert {(run.away_key, run.home_key) for run in runs} == {("B", "A")}
+    assert (distribution.away_key, distribution.home_key) == ("B", "A")
+    assert distribution.sample_size == 400
+    assert distribution.home_win_chance_max_se == pytest.approx(
+        summary["home_win_chance_max_se"]
+    )
+
+    # the same seed saves the same distribution again, over the old row
+    simulate(3)
+    with Session(engine) as session:
+        (replayed,) = session.execute(select(SimulationDistORM)).scalars().all()
+    assert replayed.id != distribution.id
+    assert replayed.home_win_chance_max == distribution.home_win_chance_max
+
+
+def test_margin_accumulator_matches_full_margins():
+    '''Chunked histograms should give the same breakpoints as the full margins.'''
+    rng = np.random.default_rng(1)
+    margins = rng.integers(-30, 30, size=10001)
+    accumulator = autobracket_engine.MarginAccumulator()
+    for chunk in np.array_split(np.arange(len(margins)), 7):
+        accumulator.add(
+            rng,
+            margins[chunk],
+            chunk.reshape(-1, 1, 1),
+            chunk.reshape(-1, 1).astype(float),
+            chunk,
+        )
+
+    expected = pd.Series(margins).quantile(
+        autobracket_engine.EXTRA_QUANTILES, interpolation="nearest"
+    )
+    assert (accumulator.quantile(autobracket_engine.EXTRA_QUANTILES) == expected).all()
+    assert sum(accumulator.counts.values()) == len(margins)
+    # every kept game really ended with the margin it's filed under
+    for margin, (counters, seconds, possessions) in accumulator.games.items():
+        assert len(possessions) == min(
+            accumulator.reservoir_size, accumulator.counts[margin]
+        )
+        assert (margins[possessions] == margin).all()
+        assert len(set(possessions)) == len(possessions)
+
+
+def test_chunked_simulation_summarizes_like_one_chunk():
+    '''Chunk size only changes memory use, not what the simulation reports.'''
+    chunked_results, chunked = run_engine(autobracket_engine, 3000, 1, chunk_size=250)
+    single_results, single = run_engine(autobracket_engine, 3000, 1, chunk_size=3000)
+
+    assert len(chunked_results) == len(single_results) == 15
+    assert abs(chunked["home_win_chance_max"] - single["home_win_chance_max"]) < 0.05
+    for game, margin in zip(
+        chunked_results,
+        [chunked["max_margin_bottom"], chunked["medium_margin_bottom"]],
+    ):
+        assert game["game_summary"]["home_margin"] == margin
+
+
+@pytest.mark.parametrize("compact_threshold", [0.8, 1.0])
+def test_finished_games_are_scattered_back(monkeypatch, compact_threshold):
+    '''Compacting the active games shouldn't lose or mix up any finished game.'''
+    monkeypatch.setattr(autobracket_engine, "COMPACT_THRESHOLD", compact_threshold)
+    players, batch = single_batch()
+    rng = np.random.default_rng(1)
+    counters, seconds, possessions, scores = autobracket_engine.simulate_games(
+        batch, np.zeros(2000, dtype=int), rng
+    )
+    team_points = autobracket_engine.points_by_team(players, counters)
+    away_seconds = seconds[:, players["team_index"] == 0].sum(axis=1)
+    home_seconds = seconds[:, players["team_index"] == 1].sum(axis=1)
+
+    # every game was played out to a winner, with five players per side the
+    # whole way through regulation and any overtimes
+    assert (team_points[:, 0] != team_points[:, 1]).all()
+    # and the running scores kept up with the box scores
+    assert (scores == team_points).all()
+    assert (possessions > 100).all()
+    assert np.allclose(away_seconds, home_seconds)
+    overtimes = np.round(away_seconds / 5 - 2400) / 300
+    assert np.allclose(away_seconds, 5 * (2400 + 300 * overtimes))
+    assert (overtimes >= 0).all() and (overtimes > 0).any()
+
+
+def test_rate_tables_are_packed_by_player_slot():
+    '''Each rate table row is one player's per-second event rates.'''
+    matchup_df = make_matchup_df()
+    players = autobracket_engine.player_arrays(matchup_df)
+    player = matchup_df.set_index(["Team", "PlayerID"]).loc[players["index"][3]]
+
+    assert players["defense_rates"].flags["C_CONTIGUOUS"]
+    assert players["offense_rates"].flags["C_CONTIGUOUS"]
+    assert players["defense_rates"][3, autobracket_engine.STEAL_RATE] == pytest.approx(
+        2 * player["Steals"] / (player["Minutes"] * 60)
+    )
+    assert players["offense_rates"][
+        3, autobracket_engine.ASSIST_RATE
+    ] == pytest.approx(2 * player["Assists"] / (player["Minutes"] * 60))
+
+
+def test_batch_simulation_pads_rosters_across_matchups():
+    '''Matchups with different roster sizes should simulate side by side.'''
+    matchups = [
+        (make_matchup_df("A", "B", roster_size=8, seed=1), 136.0, 0.02, -0.01),
+        (make_matchup_df("C", "D", roster_size=12, seed=2), 130.0, -0.01, 0.03),
+        (make_matchup_df("A", "D", roster_size=10, seed=3), 140.0, 0.0, 0.0),
+    ]
+    distributions = autobracket_engine.run_batch_simulation(
+        matchups, FantasyDataSeason.CURRENTSEASON, 1500, seed=1, shards=2
+    )
+    batch = autobracket_engine.matchup_batch(
+        [autobracket_engine.player_arrays(df) for df, *_ in matchups],
+        *zip(*[scalars for _, *scalars in matchups]),
+    )
+
+    # padded slots exist, but never get any minutes
+    assert batch["defense_rates"].shape[:2] == (3, 24)
+    assert np.isneginf(batch["log_minute_dist"][0][0, 8:]).all()
+    counters, seconds, _, _ = autobracket_engine.simulate_games(
+        batch, np.repeat(np.arange(3), 50), np.random.default_rng(1)
+    )
+    assert not seconds[:50, 16:].any() and not counters[:50, 16:].any()
+
+    # and every matchup summarizes like it would on its own
+    assert [(d["away_key"], d["home_key"]) for d in distributions] == [
+        ("A", "B"),
+        ("C", "D"),
+        ("A", "D"),
+    ]
+    for (matchup_df, *scalars), distribution in zip(matchups, distributions):
+        _, single = autobracket_engine.run_simulation(
+            matchup_df, FantasyDataSeason.CURRENTSEASON, 1500, *scalars, seed=2
+        )
+        assert single.keys() == distribution.keys()
+        assert (
+            abs(single["home_win_chance_max"] - distribution["home_win_chance_max"])
+            < 0.06
+        )
+
+
+def run_variance_reduction(variance_reduction, sample_size=2000, **kwargs):
+    matchups = [
+        (make_matchup_df(), 136.0, 0.02, -0.01),
+        (make_matchup_df(seed=9), 136.0, 0.0, 0.0),
+    ]
+    return autobracket_engine.run_batch_simulation(
+        matchups,
+        FantasyDataSeason.CURRENTSEASON,
+        sample_size,
+        seed=1,
+        variance_reduction=variance_reduction,
+        **kwargs,
+    )
+
+
+def test_independent_games_report_the_binomial_standard_error():
+    '''Without variance reduction, the max win chance's error is sqrt(p(1 - p) / n).'''
+    for distribution in run_variance_reduction(VarianceReduction.NONE, 1000):
+        chance = distribution["home_win_chance_max"]
+        assert np.isclose(
+            distribution["home_win_chance_max_se"],
+            np.sqrt(chance * (1 - chance) / 1000),
+        )
+        for flavor in ["medium", "mild", "median"]:
+            # narrow ranges can be all wins (or losses), with no error at all
+            assert 0 <= distribution[f"home_win_chance_{flavor}_se"] < 0.1
+
+
+def test_antithetic_pairs_shrink_the_standard_error():
+    '''Antithetic games should estimate the same chances with smaller errors.'''
+    independent = run_variance_reduction(VarianceReduction.NONE)
+    for variance_reduction in [
+        VarianceReduction.ANTITHETIC,
+        VarianceReduction.ANTITHETIC_COMMON,
+    ]:
+        for plain, paired in zip(
+            independent, run_variance_reduction(variance_reduction)
+        ):
+            assert (
+                abs(plain["home_win_chance_max"] - paired["home_win_chance_max"])
+                < 4 * plain["home_win_chance_max_se"]
+            )
+            assert paired["home_win_chance_max_se"] < plain["home_win_chance_max_se"]
+
+    # pairs are never split, so odd sample sizes round up to whole pairs
+    sample_size = autobracket_engine.paired_sample_size(
+        7, VarianceReduction.ANTITHETIC
+    )
+    _, stream, flip = autobracket_engine.shared_streams(
+        autobracket_engine.SeededRNG(1),
+        np.zeros(sample_size, dtype=np.intp),
+        VarianceReduction.ANTITHETIC,
+    )
+    assert stream.tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+    assert flip.tolist() == [False, True] * 4
+
+
+def test_shared_streams_ignore_shards_and_chunks():
+    '''Shared random numbers depend on the game, not where it was simulated.'''
+    single = run_variance_reduction(VarianceReduction.ANTITHETIC_COMMON, 1001)
+    assert single == run_variance_reduction(
+        VarianceReduction.ANTITHETIC_COMMON, 1001, chunk_size=301
+    )
+    assert single == run_variance_reduction(
+        VarianceReduction.ANTITHETIC_COMMON, 1001, shards=3
+    )
+
+    # with common random numbers, the same matchup twice plays the same games
+    matchup = (make_matchup_df(), 136.0, 0.02, -0.01)
+    first, second = autobracket_engine.run_batch_simulation(
+        [matchup, matchup],
+        FantasyDataSeason.CURRENTSEASON,
+        500,
+        seed=1,
+        variance_reduction=VarianceReduction.COMMON,
+    )
+    assert first == second
+
+
+def test_adaptive_simulation_stops_once_the_interval_is_narrow(monkeypatch):
+    '''Lopsided matchups should stop early, and nothing should go over budget.'''
+    monkeypatch.setattr(autobracket_engine, "ADAPTIVE_BATCH_SIZE", 500)
+    matchups = [
+        (make_matchup_df(), 136.0, 0.25, -0.25),
+        (make_matchup_df(seed=9), 136.0, 0.0, 0.0),
+    ]
+
+    def run(sample_size, tolerance):
+        return autobracket_engine.run_batch_simulation(
+            matchups,
+            FantasyDataSeason.CURRENTSEASON,
+            sample_size,
+            seed=1,
+            tolerance=tolerance,
+        )
+
+    lopsided, close = run(20000, 0.025)
+    assert lopsided["sample_size"] == 500
+    assert 500 < close["sample_size"] < 20000
+    for distribution in [lopsided, close]:
+        assert (
+            autobracket_engine.CONFIDENCE_Z * distribution["home_win_chance_max_se"]
+            <= 0.025
+        )
+    assert run(20000, 0.025) == [lopsided, close]
+
+    # a tolerance that can't be met uses up the whole budget, and no more
+    assert [d["sample_size"] for d in run(1200, 0.001)] == [1200, 1200]
+
+
+def make_season_db(url="sqlite+pysqlite:///:memory:"):
+    '''A fresh DB with PlayerSeason and CBBTeam rows for teams A, B, C and D.'''
+    engine = create_engine(url, future=True)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        for team_id, (away_key, home_key) in enumerate([("A", "B"), ("C", "D")]):
+            matchup_df = make_matchup_df(away_key, home_key, seed=team_id)
+            for row in matchup_df.drop(columns="designation").to_dict("records"):
+                stat_id = 10000 * team_id + row["PlayerID"]
+                session.add(PlayerSeasonORM(**row, StatID=stat_id, Season="2021"))
+        for team_id, key in enumerate("ABCD"):
+            session.add(
+                CBBTeamORM(
+                    SeasonTeamID=team_id,
+                    Key=key,
+                    Season="2021",
+                    AdjT=68.0 + team_id,
+                    OppAdjEM=team_id - 1.5,
+                )
+            )
+        session.commit()
+    return engine
+
+
+def test_player_and_distribution_endpoints_read_from_the_db():
+    '''Season players and saved distributions come straight out of SQL.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+
+    players = asyncio.run(autobracket.get_season_players(season, engine))
+    assert len(players) == 40
+    team_players = asyncio.run(autobracket.get_season_team_players(season, "C", engine))
+    assert [player.StatID for player in team_players] == sorted(
+        player.StatID for player in players if player.Team == "C"
+    )
+    with pytest.raises(HTTPException) as missing:
+        asyncio.run(
+            autobracket.get_season_players(FantasyDataSeason.PRIORSEASON1, engine)
+        )
+    assert missing.value.status_code == 404
+
+    with pytest.raises(HTTPException):
+        asyncio.run(autobracket.get_all_simulation_dist(engine))
+    autobracket_engine.precompute_matchups(
+        engine, season, [("A", "B"), ("C", "D")], 200, seed=1
+    )
+    distributions = asyncio.run(autobracket.get_all_simulation_dist(engine))
+    assert [(row["away_key"], row["home_key"]) for row in distributions] == [
+        ("B", "A"),
+        ("D", "C"),
+    ]
+
+
+class FakeFantasyDataResponse:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def json(self):
+        return self.rows
+
+
+def test_player_season_refresh_replaces_saved_players(monkeypatch):
+    '''A refresh upserts every player season and drops the season's cached teams.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    with Session(engine) as session:
+        rows = (
+            session.execute(
+                select(PlayerSeasonORM.__table__).where(PlayerSeasonORM.Team == "A")
+            )
+            .mappings()
+            .all()
+        )
+    fantasy_data_rows = [
+        dict(
+            row,
+            Season=2021,
+            Name=f"{row['Name']} Jr.",
+            Position=None,
+            TeamID=1,
+            SeasonType=1,
+            Games=30,
+            FantasyPoints=0.0,
+            FieldGoalsPercentage=0.0,
+            TwoPointersPercentage=0.0,
+            ThreePointersPercentage=0.0,
+            FreeThrowsPercentage=0.0,
+            Rebounds=row["OffensiveRebounds"] + row["DefensiveRebounds"],
+            Points=0,
+            FantasyPointsFanDuel=0.0,
+            FantasyPointsDraftKings=0.0,
+        )
+        for row in rows
+    ]
+    for row in fantasy_data_rows:
+        for column in ("two_attempt_chance", "two_chance", "three_chance", "ft_chance"):
+            del row[column]
+    monkeypatch.setattr(autobracket, "FANTASY_DATA_KEY_CBB", "key")
+    monkeypatch.setattr(
+        autobracket.requests,
+        "get",
+        lambda url: FakeFantasyDataResponse(fantasy_data_rows),
+    )
+    autobracket_engine.load_matchups(engine, season, [("A", "B")])
+
+    asyncio.run(autobracket.refresh_fd_player_season(season, engine))
+
+    with Session(engine) as session:
+        players = session.execute(select(PlayerSeasonORM)).scalars().all()
+    assert len(players) == 40
+    refreshed = [player for player in players if player.Team == "A"]
+    assert all(player.Name.endswith(" Jr.") for player in refreshed)
+    assert all(player.Position == "Not Found" for player in refreshed)
+    assert [player.two_chance for player in refreshed] == pytest.approx(
+        [row["two_chance"] for row in rows]
+    )
+    assert not autobracket_engine.matchup_inputs.teams
+
+
+def test_team_refresh_leaves_the_cached_rosters_alone(monkeypatch):
+    '''The team feed isn't saved, so its refresh doesn't drop cached teams.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    monkeypatch.setattr(autobracket, "FANTASY_DATA_KEY_FREE", "key")
+    monkeypatch.setattr(
+        autobracket.requests, "get", lambda url: FakeFantasyDataResponse([])
+    )
+    autobracket_engine.load_matchups(engine, season, [("A", "B")])
+
+    response = asyncio.run(autobracket.refresh_fd_player_season_team(season, "A"))
+
+    assert "nothing was refreshed" in response["message"]
+    assert len(autobracket_engine.matchup_inputs.teams) == 2
+
+
+def test_k_means_endpoint_serializes_straight_from_numpy():
+    '''/kmeans hands its arrays and records to NumpyJSONResponse as they are.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+
+    response = asyncio.run(autobracket.k_means_players(season, engine))
+
+    assert isinstance(response, autobracket_json.NumpyJSONResponse)
+    body = json_body(response)
+    columns = ["two_attempt_chance", "two_chance", "three_chance", "ft_chance"]
+    assert body["scatter_columns"] == columns
+    with Session(engine) as session:
+        minutes = (
+            session.execute(
+                select(PlayerSeasonORM.Minutes).order_by(
+                    PlayerSeasonORM.Team, PlayerSeasonORM.StatID
+                )
+            )
+            .scalars()
+            .all()
+        )
+    assert body["hist_data"] == minutes
+    assert isinstance(body["inertia"], float)
+    assert body["scatter_data"]
+    for player in body["scatter_data"]:
+        assert list(player) == columns + ["player_type"]
+        assert type(player["player_type"]) is int
+        assert all(0 <= player[column] <= 1 for column in columns)
+
+
+def test_precompute_matchups_bulk_inserts_distributions():
+    '''Precomputing a matchup list writes one SimulationDist row per pair.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+
+    matchup_keys = [("A", "B"), ("A", "C"), ("B", "D")]
+    distributions = autobracket_engine.precompute_matchups(
+        engine, season, matchup_keys, 300, seed=1
+    )
+
+    with Session(engine) as session:
+        rows = session.execute(select(SimulationDistORM)).scalars().all()
+    # rows are stored with the lower team key at home
+    assert [(row.away_key, row.home_key) for row in rows] == [
+        ("B", "A"),
+        ("C", "A"),
+        ("D", "B"),
+    ]
+    assert [row.home_win_chance_max for row in rows] == [
+        distribution["home_win_chance_max"] for distribution in distributions
+    ]
+    assert all(row.season == season.value for row in rows)
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch):
+    '''A job queue over a small season DB, with a five-matchup tournament.'''
+    monkeypatch.setattr(
+        autobracket_jobs,
+        "tournament_matchups",
+        lambda season: [("A", "B"), ("A", "C"), ("A", "D"), ("B", "C"), ("C", "D")],
+    )
+    jobs = autobracket_jobs.SimulationJobQueue(autobracket_engine.SimulationPool())
+    jobs.batch_size = 2
+    return jobs, make_season_db(f"sqlite+pysqlite:///{tmp_path / 'jobs.sqlite'}")
+
+
+def count_distributions(engine):
+    with Session(engine) as session:
+        return len(session.execute(select(SimulationDistORM)).scalars().all())
+
+
+def test_simulation_job_runs_every_batch(job_queue):
+    '''A submitted job saves every matchup and reports its progress.'''
+    jobs, engine = job_queue
+    job = jobs.submit(engine, FantasyDataSeason.CURRENTSEASON, 200, seed=1)
+
+    assert job.status == SimulationJobStatus.QUEUED
+    assert (job.total_matchups, job.completed_matchups) == (5, 0)
+
+    job = asyncio.run(jobs.run(engine, job.id))
+
+    assert job.status == SimulationJobStatus.COMPLETE
+    assert (job.completed_matchups, job.retries) == (5, 0)
+    assert count_distributions(engine) == 5
+
+
+def test_simulation_job_retries_failed_batches(job_queue, monkeypatch):
+    '''Batches that fail are retried, and the job fails once they run out.'''
+    jobs, engine = job_queue
+    run_batch_simulation = autobracket_engine.run_batch_simulation
+    calls = []
+
+    def flaky_batch(*args, **kwargs):
+        calls.append(kwargs["seed"])
+        if len(calls) == 1:
+            raise RuntimeError("worker died")
+        return run_batch_simulation(*args, **kwargs)
+
+    def broken_batch(*args, **kwargs):
+        raise RuntimeError("worker died")
+
+    async def run_jobs():
+        monkeypatch.setattr(autobracket_engine, "run_batch_simulation", flaky_batch)
+        flaky = jobs.submit(engine, FantasyDataSeason.CURRENTSEASON, 200, seed=1)
+        flaky = await jobs.run(engine, flaky.id)
+        distributions = count_distributions(engine)
+
+        monkeypatch.setattr(autobracket_engine, "run_batch_simulation", broken_batch)
+        broken = jobs.submit(engine, FantasyDataSeason.CURRENTSEASON, 200, seed=1)
+        return flaky, distributions, await jobs.run(engine, broken.id)
+
+    job, distributions, broken_job = asyncio.run(run_jobs())
+
+    assert job.status == SimulationJobStatus.COMPLETE
+    assert job.retries == 1
+    # the retry reran the batch with the same seed
+    assert calls.count(calls[0]) == 2
+    assert distributions == 5
+
+    job = broken_job
+    assert job.status == SimulationJobStatus.FAILED
+    assert job.retries == 3 * jobs.max_attempts
+    assert "worker died" in job.error
+    assert job.completed_matchups == 0
+
+
+def test_simulation_jobs_share_the_pools_job_processes(job_queue, monkeypatch):
+    '''Two jobs together never run more batches at once than job_processes.'''
+    jobs, engine = job_queue
+    jobs.pool.job_processes = 1
+    run_batch_simulation = autobracket_engine.run_batch_simulation
+    running = []
+    most_running = []
+
+    def tracked_batch(*args, **kwargs):
+        running.append(1)
+        most_running.append(len(running))
+        try:
+            return run_batch_simulation(*args, **kwargs)
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(autobracket_engine, "run_batch_simulation", tracked_batch)
+    job_ids = [
+        jobs.submit(engine, FantasyDataSeason.CURRENTSEASON, 200, seed=seed).id
+        for seed in (1, 2)
+    ]
+
+    async def run_jobs():
+        return await asyncio.gather(*(jobs.run(engine, job_id) for job_id in job_ids))
+
+    finished = asyncio.run(run_jobs())
+
+    assert all(job.status == SimulationJobStatus.COMPLETE for job in finished)
+    assert len(most_running) == 6
+    assert max(most_running) == 1
+
+
+def test_interrupted_simulation_job_resumes_where_it_left_off(job_queue):
+    '''Jobs still running at shutdown only rerun the batches they hadn't saved.'''
+    jobs, engine = job_queue
+    job = jobs.submit(engine, FantasyDataSeason.CURRENTSEASON, 200, seed=1)
+    with Session(engine) as session:
+        job_row = session.get(SimulationJobORM, job.id)
+        job_row.status = SimulationJobStatus.RUNNING
+        job_row.completed_batches = [0, 2]
+        job_row.completed_matchups = 3
+        session.commit()
+
+    async def restart():
+        job_ids = await jobs.resume(engine)
+        return job_ids, await jobs.tasks[job.id]
+
+    job_ids, job = asyncio.run(restart())
+
+    assert job_ids == [job.id]
+    assert job.status == SimulationJobStatus.COMPLETE
+    assert job.completed_matchups == 5
+    # only the two matchups in batch 1 were simulated this time
+    assert count_distributions(engine) == 2
+
+
+def test_distributions_are_stored_once_per_pair():
+    '''A pair simulated from either side is stored the same way and read back oriented.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    (distribution,) = autobracket_engine.run_batch_simulation(
+        autobracket_engine.load_matchups(engine, season, [("B", "A")]),
+        season,
+        300,
+        seed=1,
+    )
+    flipped = autobracket_brackets.flip_distribution(distribution)
+    assert (flipped["away_key"], flipped["home_key"]) == ("A", "B")
+    assert flipped["home_win_chance_max"] == pytest.approx(
+        1 - distribution["home_win_chance_max"]
+    )
+    assert (flipped["max_margin_top"], flipped["max_margin_bottom"]) == (
+        -distribution["max_margin_bottom"],
+        -distribution["max_margin_top"],
+    )
+    assert flipped["median_margin"] == -distribution["median_margin"]
+
+    # both sides of the pair store the lower key at home, with the same stats
+    for side in (distribution, flipped):
+        stored = autobracket_brackets.canonical_distribution(side)
+        assert {
+            key: (value if isinstance(value, str) else pytest.approx(value))
+            for key, value in stored.items()
+        } == distribution
+
+    # and come back from whichever side the caller asks for
+    oriented = autobracket_brackets.oriented_distribution
+    assert oriented(distribution, "A", "B") == flipped
+    assert oriented(distribution, "B", "A") == distribution
+
+    autobracket_engine.precompute_matchups(engine, season, [("A", "B")], 300, seed=1)
+    with Session(engine) as session:
+        rows = (
+            session.execute(
+                select(SimulationDistORM.__table__).where(
+                    autobracket_brackets.matchup_filter("A", "B")
+                )
+            )
+            .mappings()
+            .all()
+        )
+    assert [(row["away_key"], row["home_key"]) for row in rows] == [("B", "A")]
+
+    # simulating the pair again, from the other side, replaces its row
+    (resimulated,) = autobracket_engine.precompute_matchups(
+        engine, season, [("B", "A")], 300, seed=2
+    )
+    with Session(engine) as session:
+        rows = session.execute(select(SimulationDistORM)).scalars().all()
+    assert len(rows) == 1
+    assert rows[0].id > 1
+    assert rows[0].home_win_chance_max == resimulated["home_win_chance_max"]
+
+
+def test_matchup_matrix_looks_up_either_orientation():
+    '''Each game is one lookup, flipped when the simulated home team is away.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    (distribution,) = autobracket_engine.precompute_matchups(
+        engine, season, [("A", "B")], 300, seed=1
+    )
+    matrices = autobracket_brackets.MatchupMatrixCache()
+    matrix = matrices.get(engine, season)
+
+    away_key, home_key = distribution["away_key"], distribution["home_key"]
+    chance, top, bottom = matrix.lookup(
+        BracketFlavor.MILD, [away_key, home_key], [home_key, away_key]
+    )
+    assert chance[0] == pytest.approx(distribution["home_win_chance_mild"])
+    assert (top[0], bottom[0]) == (
+        distribution["mild_margin_top"],
+        distribution["mild_margin_bottom"],
+    )
+    assert chance[1] == pytest.approx(1 - distribution["home_win_chance_mild"])
+    assert (top[1], bottom[1]) == (
+        -distribution["mild_margin_bottom"],
+        -distribution["mild_margin_top"],
+    )
+
+    # pairs that were never simulated aren't made up
+    with pytest.raises(HTTPException) as missing:
+        matrix.lookup(BracketFlavor.MILD, ["A"], ["Z"])
+    assert missing.value.status_code == 404
+
+    # the matrix is only rebuilt once new distributions are saved
+    assert matrices.get(engine, season) is matrix
+    autobracket_engine.precompute_matchups(engine, season, [("C", "D")], 300, seed=1)
+    rebuilt = matrices.get(engine, season)
+    assert rebuilt is not matrix
+    assert not np.isnan(rebuilt.lookup(BracketFlavor.MAX, ["D"], ["C"])[0]).any()
+
+    # and once a pair is simulated again
+    (resimulated,) = autobracket_engine.precompute_matchups(
+        engine, season, [("A", "B")], 300, seed=2
+    )
+    replaced = matrices.get(engine, season)
+    assert replaced is not rebuilt
+    chance, _, _ = replaced.lookup(BracketFlavor.MAX, [away_key], [home_key])
+    assert chance[0] == pytest.approx(resimulated["home_win_chance_max"])
+    assert chance[0] != pytest.approx(distribution["home_win_chance_max"])
+
+
+def tournament_tree():
+    return autobracket_tables.march_madness.tournament(
+        FantasyDataSeason.CURRENTSEASON
+    ).tree
+
+
+def make_tournament_distributions(seed=3):
+    '''A made up distribution for every pair of 2021 teams, lower key at home.'''
+    rng = np.random.default_rng(seed)
+    team_keys = tournament_tree().team_keys
+    distributions = []
+    for home_key, away_key in combinations(sorted(team_keys), 2):
+        distribution = {
+            "season": FantasyDataSeason.CURRENTSEASON.value,
+            "away_key": away_key,
+            "home_key": home_key,
+        }
+        for chance_column, top_column, bottom_column in (
+            autobracket_brackets.FLAVOR_COLUMNS.values()
+        ):
+            distribution[chance_column] = rng.random()
+            distribution[top_column] = int(rng.integers(1, 30))
+            distribution[bottom_column] = -int(rng.integers(1, 30))
+        distributions.append(distribution)
+    return distributions
+
+
+def make_tournament_matrix(seed=3):
+    '''A MatchupMatrix with a made up distribution for every pair of 2021 teams.'''
+    return autobracket_brackets.MatchupMatrix(make_tournament_distributions(seed))
+
+
+def make_tournament_db(seed=3):
+    '''A fresh DB with the made up distributions saved for the 2021 season.'''
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        autobracket_brackets.save_distributions(
+            session, make_tournament_distributions(seed)
+        )
+        session.commit()
+    return engine
+
+
+def bracket_endpoint_kwargs(engine):
+    '''The bracket endpoints' dependencies, with a fresh matrix cache.'''
+    return dict(
+        engine=engine,
+        matrices=autobracket_brackets.MatchupMatrixCache(),
+        registry=autobracket_tables.march_madness,
+    )
+
+
+def json_body(response):
+    return orjson.loads(response.body)
+
+
+def walk_bracket(matrix, flavor, rerolls):
+    '''Advance winners one game at a time, the way brackets used to be built.'''
+    bracket = autobracket_tables.march_madness.tournament(
+        FantasyDataSeason.CURRENTSEASON
+    ).bracket
+    bracket_df = pd.DataFrame(bracket).set_index("game_id")
+    winners = []
+    for x, reroll in zip(bracket_df.index, rerolls):
+        away_key = bracket_df.at[x, "away_key"]
+        home_key = bracket_df.at[x, "home_key"]
+        home_win_chance = matrix.lookup(flavor, [away_key], [home_key])[0][0]
+        game_winner = home_key if reroll < home_win_chance else away_key
+        winners.append(game_winner)
+
+        advancing_location = bracket_df.at[x, "advance_to"]
+        if advancing_location == 68:
+            break
+        elif bracket_df.at[advancing_location, "away_key"] == "TBD":
+            bracket_df.at[advancing_location, "away_key"] = game_winner
+        else:
+            bracket_df.at[advancing_location, "home_key"] = game_winner
+    return winners
+
+
+def test_bracket_tree_advances_winners_like_the_game_by_game_walk():
+    '''Vectorized rounds pick the same winners as walking the bracket in order.'''
+    tree = tournament_tree()
+    matrix = make_tournament_matrix()
+    rerolls = np.random.default_rng(5).random(size=(20, len(tree.game_ids)))
+
+    slots, home_wins = tree.simulate(matrix, BracketFlavor.MEDIUM, rerolls)
+    winners = tree.winners(slots, home_wins)
+
+    assert winners.shape == (20, 67)
+    for bracket, bracket_rerolls in zip(winners, rerolls):
+        expected = walk_bracket(matrix, BracketFlavor.MEDIUM, bracket_rerolls)
+        assert list(bracket) == expected
+
+
+def test_bracket_endpoints_draw_the_same_brackets_for_a_seed():
+    '''/bracket and /brackets return the winners of the same seeded draw.'''
+    engine = make_tournament_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    kwargs = bracket_endpoint_kwargs(engine)
+
+    response = asyncio.run(
+        autobracket.single_sim_bracket(season, BracketFlavor.MILD, seed=4, **kwargs)
+    )
+    bracket = json_body(response)
+    assert response.headers["Simulation-Seed"] == "4"
+    assert all(game["sim_seed"] == 4 for game in bracket)
+
+    batch = json_body(
+        asyncio.run(
+            autobracket.many_sim_brackets(
+                season, BracketFlavor.MILD, 3, seed=4, **kwargs
+            )
+        )
+    )
+    assert batch["seed"] == 4
+    assert len(batch["brackets"]) == 3
+    assert batch["brackets"][0] == [game["sim_winner"] for game in bracket]
+
+    # every game after the First Four is played by winners of earlier games
+    games = dict(zip(batch["game_ids"], bracket))
+    for game in bracket:
+        assert game["sim_winner"] in (game["away_key"], game["home_key"])
+        assert (game["sim_winner"] == game["home_key"]) == (
+            game["sim_reroll"] < game["home_win_chance"]
+        )
+        if game["advance_to"] != 68:
+            advancing = games[game["advance_to"]]
+            assert game["sim_winner"] in (
+                advancing["away_key"],
+                advancing["home_key"],
+            )
+    assert batch["brackets"][1] != batch["brackets"][0]
+
+    # an unseeded bracket hands back the seed that replays it
+    response = asyncio.run(
+        autobracket.single_sim_bracket(season, BracketFlavor.MAX, seed=None, **kwargs)
+    )
+    seed = int(response.headers["Simulation-Seed"])
+    assert json_body(response)[0]["sim_seed"] == seed
+    replayed = asyncio.run(
+        autobracket.single_sim_bracket(season, BracketFlavor.MAX, seed=seed, **kwargs)
+    )
+    assert replayed.body == response.body
+
+
+def test_bracket_tree_simulates_ten_thousand_brackets_quickly():
+    '''A batch of 10,000 brackets comes back in well under a second.'''
+    tree = tournament_tree()
+    matrix = make_tournament_matrix()
+    rerolls = np.random.default_rng(5).random(size=(10000, len(tree.game_ids)))
+
+    start_time = perf_counter()
+    slots, home_wins = tree.simulate(matrix, BracketFlavor.MAX, rerolls)
+    tree.winners(slots, home_wins).tolist()
+    assert perf_counter() - start_time < 1
+
+
+def test_bracket_tree_advancement_matches_simulated_brackets():
+    '''Exact advancement chances line up with tallying lots of brackets.'''
+    tree = tournament_tree()
+    matrix = make_tournament_matrix()
+
+    game_win_chances = tree.advancement(matrix, BracketFlavor.MILD)
+    # every game has exactly one winner
+    assert game_win_chances.sum(axis=1) == pytest.approx(np.ones(67))
+
+    rerolls = np.random.default_rng(5).random(size=(20000, len(tree.game_ids)))
+    winners = tree.winners(*tree.simulate(matrix, BracketFlavor.MILD, rerolls))
+    tallies = (winners[..., None] == tree.team_keys).mean(axis=0)
+    assert np.abs(tallies - game_win_chances).max() < 0.02
+
+
+def test_advancement_endpoint_reports_every_teams_chances():
+    '''/advancement lists each team's exact chances, best title chance first.'''
+    engine = make_tournament_db()
+    tree = tournament_tree()
+    expected = tree.advancement(make_tournament_matrix(), BracketFlavor.MEDIUM)
+
+    teams = json_body(
+        asyncio.run(
+            autobracket.bracket_advancement(
+                FantasyDataSeason.CURRENTSEASON,
+                BracketFlavor.MEDIUM,
+                **bracket_endpoint_kwargs(engine),
+            )
+        )
+    )
+
+    assert sorted(team["key"] for team in teams) == sorted(tree.team_keys)
+    title_chances = [team["title_chance"] for team in teams]
+    assert title_chances == sorted(title_chances, reverse=True)
+    assert sum(title_chances) == pytest.approx(1)
+    games = {game_id: g for g, game_id in enumerate(tree.game_ids)}
+    for team in teams:
+        column = list(tree.team_keys).index(team["key"])
+        assert team["title_chance"] == pytest.approx(expected[-1, column])
+        assert {
+            int(game_id): chance for game_id, chance in team["game_win_chances"].items()
+        } == {
+            game_id: pytest.approx(expected[g, column])
+            for game_id, g in games.items()
+            if expected[g, column] > 0
+        }
+
+
+def test_optimal_bracket_beats_every_other_bracket():
+    '''The DP's picks score at least as well as any bracket, play-in included.'''
+    bracket_df = pd.DataFrame(
+        {
+            "game_id": [1, 2, 3, 4],
+            "away_key": ["X", "A", "TBD", "TBD"],
+            "away_seed": [16, 1, 16, "TBD"],
+            "away_school": ["X", "A", "TBD", "TBD"],
+            "home_key": ["Y", "B", "C", "TBD"],
+            "home_seed": [16, 8, 1, "TBD"],
+            "home_school": ["Y", "B", "C", "TBD"],
+            "advance_to": [3, 4, 4, 5],
+        }
+    ).set_index("game_id")
+    tree = autobracket_brackets.BracketTree(bracket_df)
+    assert tree.round.tolist() == [0, 1, 1, 2]
+
+    rng = np.random.default_rng(11)
+    distributions = [
+        dict(
+            {"away_key": away_key, "home_key": home_key},
+            **{
+                column: value
+                for columns in autobracket_brackets.FLAVOR_COLUMNS.values()
+                for column, value in zip(columns, (rng.random(), 10, -10))
+            },
+        )
+        for home_key, away_key in combinations(sorted(tree.team_keys), 2)
+    ]
+    matrix = autobracket_brackets.MatchupMatrix(distributions)
+    game_win_chances = tree.advancement(matrix, BracketFlavor.MAX)
+    round_points = [1, 3, 10]
+
+    picks, expected_score = tree.optimal_bracket(game_win_chances, round_points)
+    pick_chances = game_win_chances[np.arange(4), picks]
+    points = np.array(round_points)[tree.round]
+    assert expected_score == pytest.approx((points * pick_chances).sum())
+
+    # every bracket comes from some set of game results, so try all of them
+    outcomes = np.array(list(product([0, 1], repeat=4)), dtype=float)
+    winners = tree.winners(*tree.simulate(matrix, BracketFlavor.MAX, outcomes))
+    team_index = {key: team for team, key in enumerate(tree.team_keys)}
+    scores = [
+        sum(
+            points[g] * game_win_chances[g, team_index[winner]]
+            for g, winner in enumerate(bracket)
+        )
+        for bracket in winners
+    ]
+    assert expected_score == pytest.approx(max(scores))
+    assert tree.team_keys[picks].tolist() in winners.tolist()
+
+
+def test_optimal_bracket_endpoint_scores_its_picks():
+    '''/optimal returns the solver's picks, each with its expected points.'''
+    engine = make_tournament_db()
+    tree = tournament_tree()
+    round_points = [1, 2, 4, 8, 16, 32, 64]
+    game_win_chances = tree.advancement(make_tournament_matrix(), BracketFlavor.NONE)
+    picks, expected_score = tree.optimal_bracket(game_win_chances, round_points)
+
+    optimal = json_body(
+        asyncio.run(
+            autobracket.optimal_bracket(
+                FantasyDataSeason.CURRENTSEASON,
+                BracketFlavor.NONE,
+                round_points=round_points,
+                **bracket_endpoint_kwargs(engine),
+            )
+        )
+    )
+
+    assert optimal["expected_score"] == pytest.approx(expected_score)
+    assert optimal["round_points"] == round_points
+    assert [pick["game_id"] for pick in optimal["picks"]] == tree.game_ids.tolist()
+    assert [pick["sim_winner"] for pick in optimal["picks"]] == (
+        tree.team_keys[picks].tolist()
+    )
+    assert sum(pick["expected_points"] for pick in optimal["picks"]) == pytest.approx(
+        expected_score
+    )
+    for pick in optimal["picks"]:
+        assert pick["expected_points"] == pytest.approx(
+            pick["win_chance"] * round_points[pick["round"]]
+        )
+
+    # points are needed for every round
+    with pytest.raises(HTTPException) as short:
+        asyncio.run(
+            autobracket.optimal_bracket(
+                FantasyDataSeason.CURRENTSEASON,
+                BracketFlavor.NONE,
+                round_points=round_points[:-1],
+                **bracket_endpoint_kwargs(engine),
+            )
+        )
+    assert short.value.status_code == 400
+
+
+def test_march_madness_tables_are_typed_and_read_only():
+    '''Every CSV is parsed once into typed rows and locked arrays.'''
+    registry = autobracket_tables.MarchMadnessRegistry()
+    registry.load()
+
+    tables = registry.tournament_results(FantasyDataSeason.CURRENTSEASON)
+    assert len(tables.bracket) == 67
+    assert isinstance(tables.bracket[0], autobracket_tables.BracketGame)
+    assert isinstance(tables.bracket[0].game_id, int)
+    assert isinstance(tables.kenpom[0].AdjEM, float)
+    assert (tables.result_codes >= 0).all()
+    assert registry.school_names
+
+    with pytest.raises(ValueError):
+        tables.tree.slots[0, 0] = 0
+    with pytest.raises(ValueError):
+        tables.result_codes[0] = 0
+    with pytest.raises(AttributeError):
+        tables.tree = None
+
+    # 2020 has Kenpom ratings but no tournament
+    assert registry.season(FantasyDataSeason.PRIORSEASON1).kenpom
+    with pytest.raises(HTTPException):
+        registry.tournament(FantasyDataSeason.PRIORSEASON1)
+
+
+def test_simulated_bracket_cache_checks_every_pick_at_once():
+    '''Saved brackets load as int16 picks and only new rows are read after that.'''
+    tree = tournament_tree()
+    matrix = make_tournament_matrix()
+    rerolls = np.random.default_rng(5).random(size=(6, len(tree.game_ids)))
+    winners = tree.winners(*tree.simulate(matrix, BracketFlavor.MILD, rerolls))
+    flavors = [BracketFlavor.MILD, BracketFlavor.MAX] * 3
+
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+
+    def save_brackets(rows):
+        with Session(engine) as session:
+            for bracket, flavor in rows:
+                session.add(
+                    SimulatedBracketORM(
+                        flavor=flavor,
+                        bracket={
+                            f"{game_id:02}": team
+                            for game_id, team in zip(tree.game_ids, bracket)
+                        },
+                    )
+                )
+            session.commit()
+
+    cache = autobracket_brackets.SimulatedBracketCache()
+    with pytest.raises(HTTPException):
+        cache.get(engine, tree)
+
+    save_brackets(zip(winners[:4].tolist(), flavors[:4]))
+    brackets = cache.get(engine, tree)
+    assert brackets.picks.dtype == np.int16
+    assert (tree.team_keys[brackets.picks] == winners[:4]).all()
+
+    # only the new brackets get decoded
+    save_brackets(zip(winners[4:].tolist(), flavors[4:]))
+    brackets = cache.get(engine, tree)
+    assert brackets.ids.tolist() == [1, 2, 3, 4, 5, 6]
+    assert (tree.team_keys[brackets.picks] == winners).all()
+
+    # checking against one of the brackets gets every one of its picks right
+    correct = brackets.correct(brackets.picks[2])
+    assert correct[2].all()
+    assert correct.sum(axis=1).tolist() == [
+        (bracket == winners[2]).sum() for bracket in winners
+    ]
+    assert brackets.flavor_mask(BracketFlavor.MAX).tolist() == [
+        flavor == BracketFlavor.MAX for flavor in flavors
+    ]
+
+    # deleting a bracket rebuilds the columns
+    with Session(engine) as session:
+        session.delete(session.get(SimulatedBracketORM, 3))
+        session.commit()
+    assert cache.get(engine, tree).ids.tolist() == [1, 2, 4, 5, 6]
+
+
+def test_performance_endpoints_check_saved_brackets_against_the_results():
+    '''The checkers score saved brackets game by game and bracket by bracket.'''
+    tables = autobracket_tables.march_madness.tournament_results(
+        FantasyDataSeason.CURRENTSEASON
+    )
+    tree = tables.tree
+    results = tree.team_keys[tables.result_codes]
+    rerolls = np.random.default_rng(5).random(size=(3, len(tree.game_ids)))
+    winners = tree.winners(
+        *tree.simulate(make_tournament_matrix(), BracketFlavor.MILD, rerolls)
+    )
+    brackets = [results.tolist()] + winners.tolist()
+    flavors = [BracketFlavor.MAX] + [BracketFlavor.MILD] * 2 + [BracketFlavor.NONE]
+
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        for bracket, flavor in zip(brackets, flavors):
+            session.add(
+                SimulatedBracketORM(
+                    flavor=flavor,
+                    bracket={
+                        f"{game_id:02}": team
+                        for game_id, team in zip(tree.game_ids.tolist(), bracket)
+                    },
+                )
+            )
+        session.commit()
+    kwargs = dict(
+        engine=engine,
+        saved_brackets=autobracket_brackets.SimulatedBracketCache(),
+        registry=autobracket_tables.march_madness,
+    )
+    correct = np.array(brackets) == results
+
+    by_game = json_body(asyncio.run(autobracket.bracket_checker_by_game(**kwargs)))
+    assert list(by_game) == ["All", "Vanilla", "Mild", "MAX SPICE"]
+    assert list(by_game["All"].values()) == pytest.approx(correct.mean(axis=0))
+    assert list(by_game["Mild"].values()) == pytest.approx(correct[1:3].mean(axis=0))
+    assert all(chance == 1 for chance in by_game["MAX SPICE"].values())
+
+    leaders = json_body(
+        asyncio.run(autobracket.bracket_checker_by_bracket(top=2, **kwargs))
+    )
+    assert len(leaders) == 2
+    assert leaders[0] == {
+        "_id": "1",
+        "flavor": "max",
+        "games_correct": 67,
+        "points": sum(
+            autobracket.DEFAULT_ROUND_POINTS[game_round]
+            for game_round in tree.round.tolist()
+        ),
+    }
+    everyone = json_body(
+        asyncio.run(autobracket.bracket_checker_by_bracket(top=None, **kwargs))
+    )
+    assert [bracket["games_correct"] for bracket in everyone] == (
+        correct.sum(axis=1).tolist()
+    )
+
+    for node in (1, 67):
+        game = tree.game_ids.tolist().index(node)
+        assert asyncio.run(
+            autobracket.game_checker(node=node, **kwargs)
+        ) == pytest.approx(correct[:, game].mean())
+
+
+def test_simulation_runs_are_saved_with_lookup_columns():
+    '''Saved runs copy their matchup and margin out of the JSON for the index,
+    lower team key as home.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    ((matchup_df, tempo, home_strength, away_strength),) = (
+        autobracket_engine.load_matchups(engine, season, [("A", "B")])
+    )
+    results, _ = autobracket_engine.run_simulation(
+        matchup_df,
+        season,
+        300,
+        tempo,
+        home_strength,
+        away_strength,
+        seed=2,
+        packed_box_scores=True,
+    )
+
+    with Session(engine) as session:
+        session.execute(
+            insert(SimulationRunORM), autobracket_engine.simulation_run_rows(results)
+        )
+        session.commit()
+
+        # B was home in the simulation, so the stored margins are from A's side
+        sql = (
+            select(SimulationRunORM)
+            .where(
+                SimulationRunORM.season == season.value,
+                SimulationRunORM.away_key == "B",
+                SimulationRunORM.home_key == "A",
+                SimulationRunORM.home_margin >= 0,
+            )
+            .order_by(SimulationRunORM.home_margin)
+        )
+        simulation_runs = session.execute(sql).scalars().all()
+        assert [run.home_margin for run in simulation_runs] == sorted(
+            -game["game_summary"]["home_margin"]
+            for game in results
+            if game["game_summary"]["home_margin"] <= 0
+        )
+        assert all(
+            run.game_summary["home_key"] == "B" for run in simulation_runs
+        )
+
+        # packed box scores pick their names back up from the player seasons
+        game = autobracket_engine.simulation_run_document(session, simulation_runs[0])
+        assert game["game_summary"] == simulation_runs[0].game_summary
+        assert {player["Name"] for player in game["full_box_score"].values()} == {
+            row.Name
+            for row in session.execute(
+                select(PlayerSeasonORM).where(PlayerSeasonORM.Team.in_(["A", "B"]))
+            ).scalars()
+        }
+
+
+def save_simulation_runs(engine, away_key, home_key, sample_size=300, seed=2):
+    '''Simulate a matchup and save its runs, the way /sim does.'''
+    season = FantasyDataSeason.CURRENTSEASON
+    ((players, tempo, home_strength, away_strength),) = (
+        autobracket_engine.load_matchups(engine, season, [(away_key, home_key)])
+    )
+    results, _ = autobracket_engine.run_simulation(
+        players,
+        season,
+        sample_size,
+        tempo,
+        home_strength,
+        away_strength,
+        seed=seed,
+        packed_box_scores=True,
+    )
+    with Session(engine) as session:
+        session.execute(
+            insert(SimulationRunORM), autobracket_engine.simulation_run_rows(results)
+        )
+        session.commit()
+    return results
+
+
+def home_margin(game, home_key):
+    '''A game's margin from home_key's side, whichever side it was simulated from.'''
+    game_summary = game["game_summary"]
+    if game_summary["home_key"] == home_key:
+        return game_summary["home_margin"]
+    return -game_summary["home_margin"]
+
+
+def test_single_sim_game_replays_a_seed_from_either_side():
+    '''/game picks the same run for a seed, inside the flavor's margin range.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    results = save_simulation_runs(engine, "A", "B")
+
+    for away_key, home_key in [("A", "B"), ("B", "A")]:
+        margins = [home_margin(game, home_key) for game in results]
+        low, high = np.quantile(margins, autobracket.GAME_QUANTILES[BracketFlavor.MILD])
+        picked = set()
+        for seed in range(8):
+            response = asyncio.run(
+                autobracket.single_sim_game(
+                    season, away_key, home_key, BracketFlavor.MILD, seed, engine
+                )
+            )
+            replayed = asyncio.run(
+                autobracket.single_sim_game(
+                    season, away_key, home_key, BracketFlavor.MILD, seed, engine
+                )
+            )
+            assert response.headers["Simulation-Seed"] == str(seed)
+            assert replayed.body == response.body
+            game = json_body(response)
+            assert low <= home_margin(game, home_key) <= high
+            picked.add(response.body)
+        assert len(picked) > 1
+
+    with pytest.raises(HTTPException) as missing:
+        asyncio.run(
+            autobracket.single_sim_game(season, "C", "D", BracketFlavor.MILD, 1, engine)
+        )
+    assert missing.value.status_code == 404
+
+
+def test_bracket_box_scores_come_from_each_games_margin_range():
+    '''/bracket pulls one run per game from inside its range, oriented to the game.'''
+    engine = make_tournament_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    kwargs = bracket_endpoint_kwargs(engine)
+
+    def draw_bracket():
+        return json_body(
+            asyncio.run(
+                autobracket.single_sim_bracket(
+                    season, BracketFlavor.MEDIUM, seed=9, **kwargs
+                )
+            )
+        )
+
+    # nothing simulated yet, so the bracket comes back without box scores
+    bracket = draw_bracket()
+    assert "sim_ObjectId" not in bracket[0]
+
+    # every margin from -30 to 30 for each game, saved from alternating sides
+    results = []
+    for game in bracket:
+        for margin in range(-30, 31):
+            away_key, home_key = game["away_key"], game["home_key"]
+            if margin % 2:
+                away_key, home_key, margin = home_key, away_key, -margin
+            results.append(
+                {
+                    "game_summary": {
+                        "season": season.value,
+                        "away_key": away_key,
+                        "home_key": home_key,
+                        "home_margin": margin,
+                        "total_possessions": 140,
+                    },
+                    "seed": 9,
+                }
+            )
+    # except for the title game, and with one blowout too big for any range
+    results = [
+        game
+        for game in results
+        if {game["game_summary"]["away_key"], game["game_summary"]["home_key"]}
+        != {bracket[-1]["away_key"], bracket[-1]["home_key"]}
+    ]
+    blowout = dict(results[0]["game_summary"], home_margin=35)
+    results.append({"game_summary": blowout, "seed": 9})
+    with Session(engine) as session:
+        session.execute(
+            insert(SimulationRunORM), autobracket_engine.simulation_run_rows(results)
+        )
+        session.commit()
+
+    bracket = draw_bracket()
+    for game in bracket[:-1]:
+        if game["sim_winner"] == game["home_key"]:
+            low, high = 0, game["medium_margin_top"]
+        else:
+            low, high = game["medium_margin_bottom"], 0
+        assert low <= game["home_margin"] <= high
+        assert game["total_possessions"] == 140
+
+        # the picked run is the same game, from the bracket's side
+        (run,) = json_body(
+            asyncio.run(autobracket.recall_sim_game(game["sim_ObjectId"], engine))
+        )
+        assert home_margin(run, game["home_key"]) == game["home_margin"]
+        assert {
+            run["game_summary"]["away_key"],
+            run["game_summary"]["home_key"],
+        } == {game["away_key"], game["home_key"]}
+    assert bracket[-1]["sim_ObjectId"] is None
+    assert draw_bracket() == bracket
+
+    with pytest.raises(HTTPException) as missing:
+        asyncio.run(autobracket.recall_sim_game(len(results) + 1, engine))
+    assert missing.value.status_code == 404
+
+    # margins come back sorted, from whichever side the caller asks for
+    away_key, home_key = blowout["away_key"], blowout["home_key"]
+    assert asyncio.run(
+        autobracket.matchup_sim_margin(season, away_key, home_key, engine)
+    ) == list(range(-30, 31)) + [35]
+    assert asyncio.run(
+        autobracket.matchup_sim_margin(season, home_key, away_key, engine)
+    ) == [-35] + list(range(-30, 31))
+    assert asyncio.run(autobracket.matchup_sim_margin(season, "A", "B", engine)) == []
+
+
+def test_matchup_inputs_are_cached_per_team():
+    '''Teams are loaded once, evicted least recently used, and dropped on refresh.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    cache = autobracket_engine.MatchupInputCache()
+    cache.max_teams = 3
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *args: queries.append(args))
+
+    teams = cache.get(engine, season, ["A", "B"])
+    assert len(queries) == 2
+    arrays, tempo, strength = teams["A"]
+    assert list(arrays["player_ids"]) == sorted(arrays["player_ids"])
+    assert arrays["minute_dist"].sum() == pytest.approx(1)
+
+    # cached teams are a lookup, and only the missing team is loaded
+    assert cache.get(engine, season, ["B", "A"])["A"] is teams["A"]
+    assert len(queries) == 2
+    cache.get(engine, season, ["C", "A"])
+    assert len(queries) == 4
+    assert list(cache.teams) == [(season, "B"), (season, "C"), (season, "A")]
+
+    # past max_teams, the least recently used team goes
+    cache.get(engine, season, ["D"])
+    assert list(cache.teams) == [(season, "C"), (season, "A"), (season, "D")]
+
+    # a refresh drops the whole season
+    cache.invalidate(season)
+    assert not cache.teams
+
+    with pytest.raises(HTTPException) as missing:
+        cache.get(engine, season, ["A", "Z"])
+    assert missing.value.status_code == 404
+
+
+def test_load_matchups_matches_building_the_matchup_frame():
+    '''Matchups put together from cached teams are the same as from a matchup_df.'''
+    engine = make_season_db()
+    season = FantasyDataSeason.CURRENTSEASON
+    ((players, tempo, home_strength, away_strength),) = (
+        autobracket_engine.load_matchups(engine, season, [("C", "A")])
+    )
+
+    with Session(engine) as session:
+        matchup_df = pd.DataFrame(
+            session.execute(
+                select(PlayerSeasonORM.__table__).where(
+                    PlayerSeasonORM.Team.in_(["A", "C"])
+                )
+            )
+            .mappings()
+            .all()
+        )
+    matchup_df["designation"] = np.where(matchup_df.Team == "C", "away", "home")
+    expected = autobracket_engine.player_arrays(matchup_df)
+
+    assert players["team_keys"] == ["C", "A"] == expected["team_keys"]
+    assert players["index"].equals(expected["index"])
+    for key in ("team_index", "minute_dist", "defense_rates", "offense_rates"):
+        np.testing.assert_array_equal(players[key], expected[key])
+    # A is team 0 and C is team 2 in make_season_db
+    assert tempo == 68.0 + 70.0
+    assert (home_strength, away_strength) == (-1.5 / 500, 0.5 / 500)